@@ -8,6 +8,9 @@ from dotenv import load_dotenv
 import os
 import logging
 import pytz
+from config import DB_NAME
+from indexes import ensure_indexes
+from llmstats import LLMCallStats, llm_calls_collection
 
 load_dotenv()
 
@@ -163,6 +166,16 @@ def connect_mongodb():
         raise ValueError("MONGO_URI environment variable not set")
     return MongoClient(uri)
 
+@st.cache_resource
+def bootstrap_indexes():
+    # 每个进程只执行一次；和 worker 共用同一套索引定义
+    client = connect_mongodb()
+    try:
+        ensure_indexes(client[DB_NAME])
+    finally:
+        client.close()
+    return True
+
 def contains_illegal_char(value):
     try:
         if isinstance(value, dict):
@@ -184,12 +197,24 @@ def clean_illegal_rows(df):
         return True
     return df[df.apply(is_row_clean, axis=1)]
 
+# 看板实际用到的字段，其余字段不从数据库传输
+DASHBOARD_FIELDS = {
+    "_id": 0, "tweet_id": 1, "text": 1, "creation_date": 1, "category": 1,
+    "keyword": 1, "favorite_count": 1, "retweet_count": 1,
+}
+
 def load_data():
     client = connect_mongodb()
     db = client["tiktok"]
 
-    unhandled = list(db["unhandled_issues"].find())
-    mishandled = list(db["mishandled_issues"].find())
+    # 这里显式加上 UTC
+    start_date = pd.Timestamp('2025-05-01', tz='UTC')
+    end_date = pd.Timestamp('2025-05-31 23:59:59', tz='UTC')
+
+    # creation_date 存为日期后，日期范围直接交给 creation_date 索引过滤
+    query = {"creation_date": {"$gte": start_date.to_pydatetime(), "$lte": end_date.to_pydatetime()}}
+    unhandled = list(db["unhandled_issues"].find(query, DASHBOARD_FIELDS))
+    mishandled = list(db["mishandled_issues"].find(query, DASHBOARD_FIELDS))
 
     df_unhandled = pd.DataFrame(unhandled)
     df_mishandled = pd.DataFrame(mishandled)
@@ -203,10 +228,6 @@ def load_data():
     else:
         df['creation_date'] = pd.NaT
 
-    # 这里显式加上 UTC
-    start_date = pd.Timestamp('2025-05-01', tz='UTC')
-    end_date = pd.Timestamp('2025-05-31 23:59:59', tz='UTC')
-
     df = df[(df['creation_date'] >= start_date) & (df['creation_date'] <= end_date)]
 
     df = clean_illegal_rows(df)
@@ -510,6 +531,7 @@ def main():
         st.session_state.generate_summary = False
 
     # 加载数据
+    bootstrap_indexes()
     df = load_data()
 
     # 日期过滤器
@@ -627,11 +649,21 @@ def main():
                 You are a TikTok governance analyst, you are now writing an important report table based on the review you have received, as a excellent PM, you should summarize the top themes, identify the most frequently mentioned issues without loosing any details. Based on the following comments, only generate a governance detailed summary table with the following columns: Major Issue Category, Specific Detailed-Issues (with specific examples as detailed as possible), Risk Analysis with rating from 1 to 5 and potential impact. ONLY generate a detailed table, do NOT generate anything else:
                 {summary_input}
                 """.strip()
-                response = openai.ChatCompletion.create(
-                    model="gpt-4o-mini",
-                    messages=[{"role": "user", "content": gpt_prompt}],
-                    temperature=0.5
-                )
+                # 摘要调用也记入 llm_calls，和分类任务的开销放在一起统计
+                client = connect_mongodb()
+                stats = LLMCallStats(client[DB_NAME][llm_calls_collection])
+                try:
+                    response = stats.chat_completion(
+                        "dashboard_summary",
+                        items=len(top_50),
+                        model="gpt-4o-mini",
+                        messages=[{"role": "user", "content": gpt_prompt}],
+                        temperature=0.5
+                    )
+                finally:
+                    stats.flush()
+                    client.close()
+                logger.info("GPT summary: " + "; ".join(stats.report(len(top_50))))
                 gpt_output = response.choices[0].message['content']
                 st.markdown("### 🧠 GPT Summary")
                 st.markdown(gpt_output)
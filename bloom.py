@@ -0,0 +1,80 @@
+import hashlib
+import json
+import math
+import os
+import threading
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings: no false negatives, tunable false-positive rate.
+
+    Memory is fixed at construction (about 1.8 MB per million items at a 0.1% error rate),
+    so it stays bounded no matter how many ids are added; past `capacity` only the
+    false-positive rate grows.
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def _positions(self, item):
+        # 双重哈希：一次 blake2b 拆成两个 64 位哈希，组合出 k 个位置
+        digest = hashlib.blake2b(str(item).encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, item):
+        positions = self._positions(item)
+        with self._lock:
+            added = False
+            for pos in positions:
+                mask = 1 << (pos & 7)
+                if not self.bits[pos >> 3] & mask:
+                    self.bits[pos >> 3] |= mask
+                    added = True
+            # 所有位都已置位说明（很可能）已经加过，不重复计数
+            if added:
+                self.count += 1
+
+    def __contains__(self, item):
+        """False 表示一定不存在；True 表示可能存在。"""
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+    @property
+    def saturated(self):
+        return self.count > self.capacity
+
+    def save(self, path, meta=None):
+        """快照到磁盘：第一行是 JSON 头，后面是原始位数组。"""
+        header = {
+            "capacity": self.capacity,
+            "error_rate": self.error_rate,
+            "count": self.count,
+            "meta": meta or {},
+        }
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(json.dumps(header).encode("utf-8") + b"\n")
+            with self._lock:
+                f.write(self.bits)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """读取快照，返回 (filter, meta)。"""
+        with open(path, "rb") as f:
+            header = json.loads(f.readline())
+            bloom = cls(header["capacity"], header["error_rate"])
+            bits = f.read()
+        if len(bits) != len(bloom.bits):
+            raise ValueError(f"Bloom snapshot {path} is truncated")
+        bloom.bits = bytearray(bits)
+        bloom.count = header["count"]
+        return bloom, header["meta"]
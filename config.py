@@ -11,6 +11,8 @@ DB_NAME = "tiktok"
 TWITTER_COLLECTION = "twitter"
 UNHANDLED_COLLECTION = "unhandled_issues"
 MISHANDLED_COLLECTION = "mishandled_issues"
+NON_ISSUE_COLLECTION = "non_issues"
+RETRY_COLLECTION = "classification_retries"
 
 # API配置
 API_HOST = "twitter154.p.rapidapi.com"
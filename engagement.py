@@ -0,0 +1,110 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from pymongo import UpdateOne
+
+import fetchdata
+from config import DB_NAME, MISHANDLED_COLLECTION, NON_ISSUE_COLLECTION, TWITTER_COLLECTION, UNHANDLED_COLLECTION
+from searchclient import SearchClient
+
+logger = logging.getLogger(__name__)
+
+details_url = "https://twitter154.p.rapidapi.com/tweet/details"
+
+refresh_days = 7  # 只刷新最近 N 天的推文，互动数主要在这段时间变化
+refresh_batch_size = 100  # 每批刷新的推文数，每批一次 bulk_write
+refresh_concurrency = 8  # 同时在途的详情请求数
+refresh_call_budget = 2000  # 每轮最多刷新多少条推文（每条一次 API 调用），None 表示不限；最久没检查的优先
+
+# 分类结果集合里是 twitter 文档的副本，看板从这里读互动数，刷新时一并更新
+COPY_COLLECTIONS = (UNHANDLED_COLLECTION, MISHANDLED_COLLECTION, NON_ISSUE_COLLECTION)
+
+# 与抓取共用同一个令牌桶，两个任务加起来也不会超过 API 配额
+details_client = SearchClient(
+    details_url, fetchdata.headers, pool_size=max(refresh_concurrency, 10), rate_limiter=fetchdata.rate_limiter
+)
+
+
+def fetch_counts(tweet_id):
+    """返回 (favorite_count, retweet_count)，请求失败或响应不是预期的 JSON 对象时返回 None。"""
+    try:
+        data = details_client.search({"tweet_id": tweet_id})
+        return data["favorite_count"], data["retweet_count"]
+    except Exception as e:
+        # 单条推文失败（API 出错、非 JSON 响应、缺字段）不影响这一批的其他推文
+        logger.warning(f"Failed to refresh tweet {tweet_id}: {e!r}")
+        return None
+
+
+def refresh_batch(collection, executor, tweets):
+    """并发拉取一批推文的最新互动数，有变化的用一次 bulk_write 写回。返回 (更新数, 失败数)。"""
+    counts = list(executor.map(fetch_counts, [tweet["tweet_id"] for tweet in tweets]))
+
+    now = datetime.utcnow()
+    operations = []
+    failed = 0
+    for tweet, latest in zip(tweets, counts):
+        if latest is None:
+            failed += 1
+            continue
+        favorite_count, retweet_count = latest
+        if favorite_count == tweet.get("favorite_count") and retweet_count == tweet.get("retweet_count"):
+            continue
+        operations.append(UpdateOne(
+            {"tweet_id": tweet["tweet_id"]},
+            {"$set": {
+                "favorite_count": favorite_count,
+                "retweet_count": retweet_count,
+                "engagement_refreshed_at": now,
+            }},
+        ))
+
+    if operations:
+        collection.bulk_write(operations, ordered=False)
+        for name in COPY_COLLECTIONS:
+            collection.database[name].bulk_write(operations, ordered=False)
+    # 无论成败、有没有变化都记下检查时间，预算有限时按它轮转
+    collection.update_many(
+        {"tweet_id": {"$in": [tweet["tweet_id"] for tweet in tweets]}}, {"$set": {"engagement_checked_at": now}}
+    )
+    return len(operations), failed
+
+
+def refresh_engagement(days=None):
+    """刷新最近 days 天内推文的 favorite_count / retweet_count，最多 refresh_call_budget 条。"""
+    days = refresh_days if days is None else days
+    client = fetchdata.connect_mongodb()
+    collection = client[DB_NAME][TWITTER_COLLECTION]
+    since = datetime.utcnow() - timedelta(days=days)
+
+    refreshed = updated = failed = 0
+    try:
+        # 从没检查过的（没有 engagement_checked_at）排在最前，预算不够时下一轮接着检查其余的
+        cursor = collection.find(
+            {"creation_date": {"$gte": since}},
+            {"_id": 0, "tweet_id": 1, "favorite_count": 1, "retweet_count": 1},
+        ).sort([("engagement_checked_at", 1), ("creation_date", -1)]).batch_size(refresh_batch_size)
+        if refresh_call_budget is not None:
+            cursor = cursor.limit(refresh_call_budget)
+
+        with ThreadPoolExecutor(max_workers=refresh_concurrency) as executor:
+            batch = []
+            for tweet in cursor:
+                batch.append(tweet)
+                if len(batch) >= refresh_batch_size:
+                    batch_updated, batch_failed = refresh_batch(collection, executor, batch)
+                    refreshed, updated, failed = refreshed + len(batch), updated + batch_updated, failed + batch_failed
+                    batch = []
+            if batch:
+                batch_updated, batch_failed = refresh_batch(collection, executor, batch)
+                refreshed, updated, failed = refreshed + len(batch), updated + batch_updated, failed + batch_failed
+
+        logger.info(f"Engagement refresh since {since:%Y-%m-%d}: checked {refreshed} tweets, "
+                    f"updated {updated}, failed {failed}")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    refresh_engagement()
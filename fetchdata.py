@@ -1,9 +1,23 @@
-import requests
+import asyncio
+import threading
 import time
-from pymongo import MongoClient
+from collections import namedtuple
+from functools import partial
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+from bson import ObjectId
+from pymongo import InsertOne, MongoClient, ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
 from dotenv import load_dotenv
 import os
+import sys
 import logging
+from bloom import BloomFilter
+from httpcache import ResponseCache
+from leases import KeywordLeases
+from ratelimit import AdaptiveTokenBucket
+from searchclient import FatalSearchError, QuotaExhaustedError, SearchClient, SearchError
+from segmentlog import SegmentLog
 
 
 load_dotenv()
@@ -822,96 +836,927 @@ min_likes = "20"
 limit = 20
 max_results = 1000000
 
-def insert_new_tweets(tweets, collection, category, keyword):
-    new_tweets = []
-    updated_count = 0
+# 搜索结果本地缓存：SEARCH_CACHE_MODE=off / record / replay（replay 只读缓存，不消耗 API 配额）
+search_cache = ResponseCache(
+    cache_dir=os.getenv("SEARCH_CACHE_DIR", ".cache/search"),
+    ttl_seconds=int(os.getenv("SEARCH_CACHE_TTL", "1800")),
+    mode=os.getenv("SEARCH_CACHE_MODE", "record"),
+)
+
+# 断点续爬配置
+checkpoint_collection = "crawl_checkpoints"
+checkpoint_ttl_hours = 12  # 关键词翻完后检查点保留的时长，过期后下一轮从第一页开始
+checkpoint_stale_hours = 6  # 没翻完的检查点超过这个时间没有推进（预算用完、进程崩溃）就作废，token 大概率已经过期
+
+# 增量抓取配置：每个关键词从自己的水位线（见过的最新 creation_date）开始查询
+watermark_collection = "keyword_watermarks"
+watermark_overlap_days = 2  # 水位线往前回看的天数，补抓搜索结果里延迟出现的推文
+
+# 抓取时是否顺带更新已有推文的互动数；默认关闭，由 engagement.py 的刷新任务负责
+crawl_updates_engagement = False
+
+# 原始 API 结果归档：入库只存精简字段，完整内容写入 zstd 压缩的 NDJSON 分段文件
+raw_archive = SegmentLog(os.getenv("RAW_ARCHIVE_DIR", "archive/raw"), prefix="raw")
+
+# 预写日志：STAGED_WRITES=1 时抓到的页面只追加到本地分段日志，由 loader.py 批量导入 Mongo，
+# 抓取不再等待 Mongo 写入；是否继续翻页改由布隆过滤器估计新推文数
+staged_writes = os.getenv("STAGED_WRITES", "0") == "1"
+staging_log = SegmentLog(os.getenv("STAGING_LOG_DIR", "staging/pages"), prefix="pages")
+# 暂存模式下检查点、水位线、关键词统计只是尽力而为：Mongo 第一次出错后本轮不再访问
+bookkeeping_available = True
+
+# 已知 tweet_id 的布隆过滤器：一定是新推文时直接插入，可能已存在时才让 Mongo 判断
+known_ids = None  # 由 fetch_data 在启动时加载
+known_ids_capacity = 5_000_000
+known_ids_error_rate = 0.001
+known_ids_snapshot = os.getenv("KNOWN_IDS_SNAPSHOT", ".cache/known_ids.bloom")
+# 只有 tweet_id 上有唯一索引时才对新推文直接 InsertOne（重复插入会被拒绝），否则全部走 upsert；由 check_unique_index 设置
+fast_inserts = False
+
+# 按历史产出调度关键词
+stats_collection = "keyword_stats"
+api_call_budget = None  # 每轮最多调用多少次 API，None 表示不限
+yield_alpha = 0.3  # 产出（新推文数 / 调用数）的指数移动平均系数
+unexplored_yield = 20.0  # 没有历史记录的关键词按满页产出估计，优先探索
+probe_interval_hours = 24  # 连续没有新推文的关键词，下次探测的基础间隔（每多一轮空跑翻倍）
+max_probe_interval_hours = 24 * 14
+
+# 多 worker 分片抓取：CRAWL_SHARDED=1 时通过 Mongo 租约分摊关键词
+shard_workers = os.getenv("CRAWL_SHARDED", "0") == "1"
+lease_collection = "keyword_leases"
+lease_ttl_seconds = 120  # 心跳停止超过这个时间，租约可被其他 worker 接手
+lease_retry_seconds = 30  # 关键词被其他 worker 持有时，下一轮重试前等待的时间
+
+# 并发抓取配置
+concurrency = 8  # 同时翻页的关键词数量
+requests_per_second = 5  # 初始请求速率，之后按 x-ratelimit-* 响应头自动调整
+max_requests_per_second = 20  # 自适应速率的上限
+write_batch_pages = 8  # 写入阶段每次 bulk_write 最多合并的页数
+
+# 所有抓取路径（串行 / 并发）共享同一个令牌桶
+rate_limiter = AdaptiveTokenBucket(rate=requests_per_second, max_rate=max_requests_per_second)
+
+# 复用连接的搜索客户端：429/5xx/网络错误按退避重试（优先遵守 Retry-After），其余错误直接失败
+search_client = SearchClient(search_url, headers, pool_size=max(concurrency, 10), rate_limiter=rate_limiter)
+
+def plan_queries(categories=None):
+    """把 query_categories 编译成去重后的查询计划 {keyword: [category, ...]}，每个查询只跑一次。"""
+    if categories is None:
+        categories = query_categories
+
+    plan = {}
+    for category, keywords in categories.items():
+        for keyword in keywords:
+            matched = plan.setdefault(" ".join(keyword.lower().split()), [])
+            if category not in matched:
+                matched.append(category)
+    return plan
+
+
+def engagement_update(tweet, categories):
+    # 互动数默认由 engagement.refresh_engagement 单独刷新，抓取只插入新推文、补充分类
+    update = {"$addToSet": {"categories": {"$each": categories}}}
+    if crawl_updates_engagement:
+        update["$set"] = {
+            "favorite_count": tweet.get("favorite_count"),
+            "retweet_count": tweet.get("retweet_count"),
+        }
+    return update
+
+
+def compact_tweet(tweet):
+    """入库的精简字段：只保留分类和看板会用到的字段，creation_date 存成真正的日期。"""
+    return {
+        "tweet_id": tweet.get("tweet_id"),
+        "text": tweet.get("text"),
+        "creation_date": parse_creation_date(tweet.get("creation_date")),
+    }
+
+
+def archive_raw(tweets):
+    """新推文的原始 API 结果追加到压缩归档（NDJSON + zstd），按 tweet_id 查找。"""
+    archived_at = datetime.utcnow().isoformat()
+    raw_archive.append([{"tweet_id": tweet["tweet_id"], "archived_at": archived_at, "raw": tweet} for tweet in tweets])
+
+
+def build_writes(tweets, categories, keyword, pending=None):
+    """返回 [(operation, tweet, categories)]。
+
+    布隆过滤器判定“一定是新推文”的直接 InsertOne，其余 upsert：新推文插入，已有推文只补充分类
+    （crawl_updates_engagement=True 时顺带更新互动数）。
+    category 保留第一个匹配分类（看板按它分组），categories 记录所有匹配分类。
+    pending 是同一次 bulk_write 里已经 InsertOne 的 tweet_id：布隆过滤器写完才更新，
+    同一批里重复出现的推文（多个关键词搜到同一条）改走 upsert。
+    """
+    writes = []
+    pending = set() if pending is None else pending
 
     for tweet in tweets:
         tweet_id = tweet.get("tweet_id")
         if not tweet_id:
             continue
 
-        existing = collection.find_one({"tweet_id": tweet_id})
-        if existing:
-            # 检查是否有变动，如果有就更新
-            updated_fields = {}
-            if tweet.get("favorite_count") != existing.get("favorite_count"):
-                updated_fields["favorite_count"] = tweet.get("favorite_count")
-            if tweet.get("retweet_count") != existing.get("retweet_count"):
-                updated_fields["retweet_count"] = tweet.get("retweet_count")
-            if updated_fields:
-                collection.update_one({"tweet_id": tweet_id}, {"$set": updated_fields})
-                updated_count += 1
+        new_fields = compact_tweet(tweet)
+        new_fields["category"] = categories[0]
+        new_fields["keyword"] = keyword
+
+        if fast_inserts and known_ids is not None and tweet_id not in known_ids and tweet_id not in pending:
+            pending.add(tweet_id)
+            operation = InsertOne({
+                **new_fields,
+                "favorite_count": tweet.get("favorite_count"),
+                "retweet_count": tweet.get("retweet_count"),
+                "categories": list(categories),
+            })
         else:
-            tweet["category"] = category
-            tweet["keyword"] = keyword
-            new_tweets.append(tweet)
+            update = engagement_update(tweet, categories)
+            if not crawl_updates_engagement:
+                # 互动数不在 $set 里时，upsert 新插入的推文（布隆误判、loader 导入）也要带上初始值
+                new_fields["favorite_count"] = tweet.get("favorite_count")
+                new_fields["retweet_count"] = tweet.get("retweet_count")
+            update["$setOnInsert"] = new_fields
+            operation = UpdateOne({"tweet_id": tweet_id}, update, upsert=True)
+        writes.append((operation, tweet, categories))
+    return writes
+
+
+def run_writes(collection, writes, archive=True):
+    """执行一次无序 bulk_write，返回 (新插入的操作下标集合, 更新数)。archive=True 时归档新推文的原始内容。"""
+    operations = [operation for operation, _, _ in writes]
+    try:
+        details = collection.bulk_write(operations, ordered=False).bulk_api_result
+    except BulkWriteError as e:
+        details = e.details
+        if any(error["code"] != 11000 for error in details["writeErrors"]):
+            raise
+
+    failed = {error["index"] for error in details.get("writeErrors", [])}
+    inserted = {upsert["index"] for upsert in details.get("upserted", [])}
+    inserted.update(index for index, op in enumerate(operations) if isinstance(op, InsertOne) and index not in failed)
+    updated = details.get("nModified", 0)
+
+    if failed:
+        # 布隆过滤器没见过、但其实已存在的推文（例如另一个进程刚插入）：改为更新已有文档
+        retries = []
+        for index in sorted(failed):
+            _, tweet, categories = writes[index]
+            retries.append(UpdateOne({"tweet_id": tweet["tweet_id"]}, engagement_update(tweet, categories)))
+        updated += collection.bulk_write(retries, ordered=False).modified_count
+
+    if archive:
+        archive_raw([writes[index][1] for index in sorted(inserted)])
+    return inserted, updated
+
+
+def check_unique_index(collection):
+    """确认 tweet_id 上有唯一索引，据此开启或关闭 InsertOne 快速路径，返回是否开启。"""
+    global fast_inserts
+    fast_inserts = any(
+        index.get("unique") and [key for key, _ in index["key"]] == ["tweet_id"]
+        for index in collection.index_information().values()
+    )
+    if not fast_inserts:
+        logger.warning(f"No unique tweet_id index on {collection.name}, writing every tweet as an upsert")
+    return fast_inserts
+
+
+def remember_known_ids(tweets):
+    if known_ids is None:
+        return
+    for tweet in tweets:
+        if tweet.get("tweet_id"):
+            known_ids.add(tweet["tweet_id"])
+
+
+def stage_pages(pages):
+    """把多页 (tweets, categories, keyword) 追加到预写日志，返回每页估计的新推文数（布隆过滤器没见过的）。"""
+    staged_at = datetime.utcnow().isoformat()
+    staging_log.append([
+        {"keyword": keyword, "categories": categories, "staged_at": staged_at, "results": tweets}
+        for tweets, categories, keyword in pages
+    ])
+
+    counts = []
+    for tweets, _, _ in pages:
+        counts.append(sum(1 for tweet in tweets if tweet.get("tweet_id") and tweet["tweet_id"] not in known_ids))
+        remember_known_ids(tweets)
+    logger.info(f"Staged {len(pages)} pages, ~{sum(counts)} new tweets")
+    return counts
+
+
+def bookkeeping(operation, *args, default=None):
+    """执行一次记账读写。暂存模式下 Mongo 出错时记录警告、返回 default，本轮后续记账直接跳过，抓取照常进行。"""
+    global bookkeeping_available
+    if not staged_writes:
+        return operation(*args)
+    if not bookkeeping_available:
+        return default
+    try:
+        return operation(*args)
+    except PyMongoError as e:
+        bookkeeping_available = False
+        logger.warning(f"MongoDB unavailable ({e}), continuing the staged crawl without checkpoints or keyword stats")
+        return default
+
+
+def insert_new_tweets(tweets, collection, categories, keyword):
+    if staged_writes:
+        return stage_pages([(tweets, categories, keyword)])[0]
+
+    # 每页只做一次 bulk_write
+    writes = build_writes(tweets, categories, keyword)
+    if not writes:
+        logger.info("Inserted 0 new tweets, Updated 0 existing tweets.")
+        return 0
+
+    inserted, updated_count = run_writes(collection, writes)
+    remember_known_ids(tweets)
+
+    logger.info(f"Inserted {len(inserted)} new tweets, Updated {updated_count} existing tweets.")
+    return len(inserted)
+
+
+def write_pages(collection, pages):
+    """把多页 (tweets, categories, keyword) 合并成一次 bulk_write，返回每页新插入的推文数。"""
+    if staged_writes:
+        return stage_pages(pages)
+
+    writes = []
+    bounds = []
+    pending = set()
+    for tweets, categories, keyword in pages:
+        start = len(writes)
+        writes.extend(build_writes(tweets, categories, keyword, pending))
+        bounds.append((start, len(writes)))
+
+    if not writes:
+        return [0] * len(pages)
+
+    inserted, updated = run_writes(collection, writes)
+    for tweets, _, _ in pages:
+        remember_known_ids(tweets)
+    # 按每页的操作下标区间拆回每页的插入数
+    counts = [sum(1 for index in inserted if start <= index < end) for start, end in bounds]
+
+    logger.info(f"Wrote {len(pages)} pages in one batch: inserted {sum(counts)} new tweets, "
+                f"updated {updated} existing tweets.")
+    return counts
+
+
+def compact_existing_tweets(collection, archive=True, batch_size=500):
+    """把旧的完整文档迁移成精简结构，archive=True 时原始内容写入归档。返回迁移的文档数。"""
+    migrated = 0
+    batch = []
+    raw = []
+
+    def flush():
+        if batch:
+            collection.bulk_write(batch, ordered=False)
+            if archive:
+                archive_raw(raw)
+            batch.clear()
+            raw.clear()
+
+    # 旧文档的 creation_date 是字符串，迁移后是日期，所以可以按类型断点续迁
+    for doc in collection.find({"creation_date": {"$type": "string"}}):
+        compact = compact_tweet(doc)
+        # 其他任务写在文档上的状态（互动数刷新、分类标签、重试标记）也要保留
+        for field in ("favorite_count", "retweet_count", "engagement_refreshed_at", "category", "categories", "keyword",
+                      "label", "classified_at", "retry", "label_source"):
+            if field in doc:
+                compact[field] = doc[field]
+
+        batch.append(ReplaceOne({"_id": doc["_id"]}, compact))
+        raw.append({k: v for k, v in doc.items() if k != "_id"})
+        migrated += 1
+        if len(batch) >= batch_size:
+            flush()
+
+    flush()
+    return migrated
+
+
+def load_known_ids(collection):
+    """加载已知 tweet_id 的布隆过滤器：先读磁盘快照，再只扫描快照之后新增的文档。"""
+    bloom, last_id = None, None
+    if os.path.exists(known_ids_snapshot):
+        try:
+            bloom, meta = BloomFilter.load(known_ids_snapshot)
+            last_id = ObjectId(meta["last_id"]) if meta.get("last_id") else None
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Ignoring unreadable known-ids snapshot: {e}")
+            bloom, last_id = None, None
+
+    if bloom is None or bloom.capacity != known_ids_capacity:
+        bloom, last_id = BloomFilter(known_ids_capacity, known_ids_error_rate), None
+
+    def scan():
+        nonlocal last_id
+        query = {"_id": {"$gt": last_id}} if last_id else {}
+        cursor = collection.find(query, {"tweet_id": 1}).sort("_id", 1).batch_size(10000)
+        scanned = 0
+        for doc in cursor:
+            if doc.get("tweet_id"):
+                bloom.add(doc["tweet_id"])
+            last_id = doc["_id"]
+            scanned += 1
+        return scanned
+
+    # 暂存模式下 Mongo 不可用时只用磁盘快照
+    scanned = bookkeeping(scan, default=0)
+
+    logger.info(f"Known-ids filter: {bloom.count} ids ({scanned} loaded from DB), {len(bloom.bits) / 1e6:.1f} MB")
+    if bloom.saturated:
+        logger.warning(f"Known-ids filter is past its capacity of {known_ids_capacity}, "
+                       f"raise known_ids_capacity to keep the false-positive rate down")
+    return bloom, last_id
+
+
+def parse_creation_date(value):
+    """把 API 的 creation_date（如 "Mon Jan 06 12:00:00 +0000 2025"）解析为 UTC naive datetime。"""
+    if isinstance(value, datetime):
+        parsed = value
+    elif isinstance(value, str):
+        try:
+            parsed = datetime.strptime(value, "%a %b %d %H:%M:%S %z %Y")
+        except ValueError:
+            try:
+                parsed = datetime.fromisoformat(value)
+            except ValueError:
+                return None
+    else:
+        return None
+
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def build_params(keyword, continuation_token=None, since=None):
+    params = {
+        "query": keyword,
+        "section": section,
+        "start_date": since or start_date,
+        "language": language,
+        "min_retweets": min_retweets,
+        "min_likes": min_likes,
+        "limit": str(limit)
+    }
+
+    if continuation_token:
+        params["continuationToken"] = continuation_token
+    return params
+
+
+def fetch_page(keyword, continuation_token=None, since=None, budget=None):
+    """请求一页搜索结果（先查本地缓存），API 出错、预算用完或回放缓存未命中时返回 None。
+
+    带 continuation_token 的请求被 API 拒绝（不可重试的 4xx，鉴权失败除外）时抛出 FatalSearchError，
+    调用方据此丢弃检查点、从第一页重新开始。
+    """
+    params = build_params(keyword, continuation_token, since)
+
+    cached = search_cache.get(search_url, params)
+    if cached is not None:
+        return cached
+    if search_cache.replay:
+        logger.warning(f"Replay cache miss for '{keyword}' (token: {continuation_token})")
+        return None
+    if budget is not None and not budget.take():
+        logger.info(f"API call budget exhausted, stopping '{keyword}'")
+        return None
+
+    try:
+        data = search_client.search(params)
+    except QuotaExhaustedError as e:
+        logger.error(f"{e}, ending the crawl")
+        if budget is not None:
+            budget.stop()
+        return None
+    except FatalSearchError as e:
+        if continuation_token and e.status_code not in (401, 403):
+            raise
+        logger.error(str(e))
+        return None
+    except SearchError as e:
+        logger.error(str(e))
+        return None
+
+    search_cache.put(search_url, params, data)
+    return data
+
+
+def checkpoints_of(collection):
+    return collection.database[checkpoint_collection]
+
+
+def ensure_checkpoint_index(collection):
+    # 只有翻完的关键词才有 drained_at，TTL 索引据此过期检查点
+    checkpoints_of(collection).create_index("drained_at", expireAfterSeconds=checkpoint_ttl_hours * 3600)
+
+
+def save_checkpoint(collection, keyword, continuation_token, page, since, newest=None):
+    # start_date 要和 continuation_token 一起保存，续爬时必须用同一组查询参数
+    update = {
+        "$set": {
+            "continuation_token": continuation_token,
+            "page": page,
+            "start_date": since,
+            "last_fetched_at": datetime.utcnow(),
+        },
+        "$unset": {"drained_at": ""},
+    }
+    if newest:
+        update["$max"] = {"newest_seen": newest}
+    checkpoints_of(collection).update_one({"_id": keyword}, update, upsert=True)
+
+
+def reset_checkpoint(collection, keyword):
+    checkpoints_of(collection).delete_one({"_id": keyword})
+
+
+def mark_drained(collection, keyword, page, newest=None):
+    now = datetime.utcnow()
+    update = {"$set": {"continuation_token": None, "page": page, "last_fetched_at": now, "drained_at": now}}
+    if newest:
+        update["$max"] = {"newest_seen": newest}
+    checkpoint = checkpoints_of(collection).find_one_and_update(
+        {"_id": keyword}, update, upsert=True, return_document=ReturnDocument.AFTER
+    )
+
+    # 关键词翻完后才推进水位线：section=top 按热度排序，中途推进会漏掉还没翻到的旧推文
+    if checkpoint.get("newest_seen"):
+        collection.database[watermark_collection].update_one(
+            {"_id": keyword},
+            {"$max": {"newest_creation_date": checkpoint["newest_seen"]}, "$set": {"updated_at": now}},
+            upsert=True,
+        )
+
+
+def keyword_start_date(collection, keyword):
+    """水位线减去回看窗口作为该关键词的 start_date，且不早于全局 start_date。"""
+    watermark = collection.database[watermark_collection].find_one({"_id": keyword})
+    if not watermark or not watermark.get("newest_creation_date"):
+        return start_date
+
+    since = watermark["newest_creation_date"] - timedelta(days=watermark_overlap_days)
+    return max(since.strftime("%Y-%m-%d"), start_date)
+
+
+def start_point(collection, keyword, resume=False):
+    """返回 (continuation_token, page, start_date)；resume 时关键词在有效期内已经翻完则返回 None。"""
+    checkpoint = checkpoints_of(collection).find_one({"_id": keyword}) if resume else None
 
-    if new_tweets:
-        collection.insert_many(new_tweets)
+    if checkpoint:
+        drained_at = checkpoint.get("drained_at")
+        if not drained_at:
+            last_fetched_at = checkpoint.get("last_fetched_at")
+            if last_fetched_at and datetime.utcnow() - last_fetched_at < timedelta(hours=checkpoint_stale_hours):
+                return (checkpoint.get("continuation_token"), checkpoint.get("page", 0),
+                        checkpoint.get("start_date") or keyword_start_date(collection, keyword))
+            logger.info(f"Discarding stale checkpoint for '{keyword}' (last page fetched at {last_fetched_at})")
+            reset_checkpoint(collection, keyword)
+            return None, 0, keyword_start_date(collection, keyword)
+        # TTL 后台任务有延迟，这里自己再判断一次是否过期
+        if datetime.utcnow() - drained_at < timedelta(hours=checkpoint_ttl_hours):
+            return None
 
-    logger.info(f"Inserted {len(new_tweets)} new tweets, Updated {updated_count} existing tweets.")
-    return len(new_tweets)
+    return None, 0, keyword_start_date(collection, keyword)
 
 
-def fetch_data():
+class TweetCounter:
+    """Run-scoped document count, seeded once from collection metadata and advanced by our own inserts."""
+
+    def __init__(self, collection):
+        self.total = bookkeeping(collection.estimated_document_count, default=0)
+        self._lock = threading.Lock()
+
+    def add(self, inserted):
+        with self._lock:
+            self.total += inserted
+            return self.total
+
+
+class CallBudget:
+    """Run-scoped API call allowance shared by every keyword; `limit=None` only counts calls."""
+
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.used = 0
+        self.stopped = False
+        self._lock = threading.Lock()
+
+    @property
+    def exhausted(self):
+        return self.stopped or (self.limit is not None and self.used >= self.limit)
+
+    def stop(self):
+        """API 套餐配额用完：本轮不再发起任何调用。"""
+        self.stopped = True
+
+    def take(self):
+        with self._lock:
+            if self.exhausted:
+                return False
+            self.used += 1
+            return True
+
+
+def record_keyword_run(collection, keyword, calls, new_tweets):
+    """更新关键词的历史产出；连续空跑的关键词按指数退避推迟下次探测。"""
+    stats = collection.database[stats_collection]
+    previous = stats.find_one({"_id": keyword}) or {}
+
+    observed = new_tweets / calls
+    expected = previous.get("yield")
+    expected = observed if expected is None else yield_alpha * observed + (1 - yield_alpha) * expected
+
+    now = datetime.utcnow()
+    empty_streak = 0 if new_tweets else previous.get("empty_streak", 0) + 1
+    next_due_at = now
+    if empty_streak:
+        next_due_at += timedelta(hours=min(max_probe_interval_hours, probe_interval_hours * 2 ** (empty_streak - 1)))
+
+    stats.update_one(
+        {"_id": keyword},
+        {
+            "$set": {"yield": expected, "empty_streak": empty_streak, "last_run_at": now, "next_due_at": next_due_at},
+            "$inc": {"calls": calls, "new_tweets": new_tweets, "runs": 1},
+        },
+        upsert=True,
+    )
+
+
+def schedule_queries(collection, plan):
+    """按预期产出从高到低排列查询计划，跳过还没到探测时间的低产关键词。"""
+    stats = {doc["_id"]: doc for doc in collection.database[stats_collection].find({"_id": {"$in": list(plan)}})}
+    now = datetime.utcnow()
+
+    due = []
+    for keyword, categories in plan.items():
+        keyword_stats = stats.get(keyword, {})
+        if keyword_stats.get("next_due_at") and keyword_stats["next_due_at"] > now:
+            continue
+        due.append((keyword_stats.get("yield", unexplored_yield), keyword, categories))
+
+    due.sort(key=lambda item: item[0], reverse=True)
+    logger.info(f"Scheduled {len(due)} keywords by expected yield, deferred {len(plan) - len(due)} low-yield keywords")
+    return {keyword: categories for _, keyword, categories in due}
+
+
+def process_page(data, collection, counter, categories, keyword, page, since):
+    """写入一页结果并更新检查点，返回 (continuation_token, 新插入数, 是否继续翻页)。"""
+    tweets = data.get("results", [])
+    logger.info(f"Page: {len(tweets)} tweets... token: {data.get('continuation_token')}")
+
+    inserted = insert_new_tweets(tweets, collection, categories, keyword)
+    return finish_page(data, collection, counter, keyword, page, since, inserted)
+
+
+def finish_page(data, collection, counter, keyword, page, since, inserted):
+    """页面写入后的记账：更新计数、检查点和水位线，判断是否继续翻页。"""
+    tweets = data.get("results", [])
+    continuation_token = data.get("continuation_token")
+    total = counter.add(inserted)
+    logger.info(f"Inserted {inserted} new tweets. Total in DB: {total}")
+
+    newest = max(filter(None, (parse_creation_date(t.get("creation_date")) for t in tweets)), default=None)
+
+    if inserted == 0:
+        logger.info("No new tweets found, moving to next keyword.")
+        bookkeeping(mark_drained, collection, keyword, page, newest)
+        return continuation_token, inserted, False
+
+    if not continuation_token:
+        bookkeeping(mark_drained, collection, keyword, page, newest)
+        return continuation_token, inserted, False
+
+    # 达到 max_results 时保留 token，下次 resume 从下一页继续
+    bookkeeping(save_checkpoint, collection, keyword, continuation_token, page, since, newest)
+    return continuation_token, inserted, total < max_results
+
+
+def restart_keyword(collection, keyword, error):
+    """续爬的 token 被 API 拒绝：删掉检查点，返回从第一页开始的 (continuation_token, page, start_date)。"""
+    logger.warning(f"Checkpoint token for '{keyword}' rejected ({error}), restarting from page 1")
+    bookkeeping(reset_checkpoint, collection, keyword)
+    return None, 0, bookkeeping(keyword_start_date, collection, keyword, default=start_date)
+
+
+def fetch_keyword(collection, counter, budget, categories, keyword, resume=False):
+    start = bookkeeping(start_point, collection, keyword, resume, default=(None, 0, start_date))
+    if start is None:
+        logger.info(f"Skipping '{keyword}': already drained")
+        return
+
+    continuation_token, page, since = start
+    resumed = continuation_token is not None
+    logger.info(f"Searching: [{', '.join(categories)}] '{keyword}' since {since} from page {page + 1}")
+    calls = new_tweets = 0
+
+    while True:
+        try:
+            data = fetch_page(keyword, continuation_token, since, budget)
+            if data is None:
+                break
+
+            resumed = False
+            page += 1
+            calls += 1
+            continuation_token, inserted, has_more = process_page(
+                data, collection, counter, categories, keyword, page, since
+            )
+            new_tweets += inserted
+            if not has_more:
+                break
+
+        except FatalSearchError as e:
+            if not resumed:
+                logger.error(f"Continuation token for '{keyword}' rejected: {e}")
+                bookkeeping(reset_checkpoint, collection, keyword)
+                break
+            resumed = False
+            continuation_token, page, since = restart_keyword(collection, keyword, e)
+
+        except Exception as e:
+            logger.error(f"Error processing request: {str(e)}")
+            break
+
+    if calls:
+        bookkeeping(record_keyword_run, collection, keyword, calls, new_tweets)
+
+
+class StageStats:
+    """Item count and busy time of one pipeline stage, for per-stage throughput reporting."""
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.batches = 0
+        self.busy_seconds = 0.0
+
+    def record(self, items, seconds):
+        self.items += items
+        self.batches += 1
+        self.busy_seconds += seconds
+
+    def summary(self, elapsed):
+        return (f"{self.name}: {self.items} pages in {self.batches} batches, "
+                f"{self.items / max(elapsed, 1e-9):.2f} pages/s, busy {self.busy_seconds:.1f}s")
+
+
+PageWrite = namedtuple("PageWrite", ["data", "categories", "keyword", "page", "since", "result"])
+
+
+def write_batch(collection, counter, batch):
+    """写入一批页面，再逐页记账，返回每页的 (continuation_token, 新插入数, 是否继续翻页)。"""
+    inserted = write_pages(collection, [
+        (item.data.get("results", []), item.categories, item.keyword) for item in batch
+    ])
+    return [
+        finish_page(item.data, collection, counter, item.keyword, item.page, item.since, count)
+        for item, count in zip(batch, inserted)
+    ]
+
+
+async def write_stage(queue, collection, counter, stats):
+    """写入阶段：从队列取出已到达的页面，合并成一次 bulk_write，收到 None 后退出。"""
+    stopping = False
+    while not stopping:
+        item = await queue.get()
+        if item is None:
+            break
+
+        batch = [item]
+        while len(batch) < write_batch_pages:
+            try:
+                item = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            if item is None:
+                stopping = True
+                break
+            batch.append(item)
+
+        started = time.monotonic()
+        try:
+            results = await asyncio.to_thread(write_batch, collection, counter, batch)
+        except Exception as e:
+            for item in batch:
+                item.result.set_exception(e)
+        else:
+            for item, result in zip(batch, results):
+                item.result.set_result(result)
+        stats.record(len(batch), time.monotonic() - started)
+
+
+async def fetch_keyword_async(queue, fetch_stats, collection, budget, categories, keyword, resume=False):
+    """抓取阶段：翻页结果放进写入队列，等写入阶段返回插入数后再决定是否翻下一页。"""
+    start = await asyncio.to_thread(bookkeeping, start_point, collection, keyword, resume, default=(None, 0, start_date))
+    if start is None:
+        logger.info(f"Skipping '{keyword}': already drained")
+        return
+
+    continuation_token, page, since = start
+    resumed = continuation_token is not None
+    logger.info(f"Searching: [{', '.join(categories)}] '{keyword}' since {since} from page {page + 1}")
+    calls = new_tweets = 0
+    loop = asyncio.get_running_loop()
+
+    while True:
+        try:
+            started = time.monotonic()
+            data = await asyncio.to_thread(fetch_page, keyword, continuation_token, since, budget)
+            fetch_stats.record(1, time.monotonic() - started)
+            if data is None:
+                break
+
+            resumed = False
+            page += 1
+            calls += 1
+            logger.info(f"Page: {len(data.get('results', []))} tweets for '{keyword}'... "
+                        f"token: {data.get('continuation_token')}")
+
+            # 每个关键词同时最多一页在途，队列长度不超过 concurrency；反压来自下面等待本页的写入结果：
+            # Mongo 变慢时抓取阶段停在这里，不会继续翻页。不预取下一页，是因为写入结果可能表明已经翻完，预取的调用就浪费了
+            result = loop.create_future()
+            await queue.put(PageWrite(data, categories, keyword, page, since, result))
+            continuation_token, inserted, has_more = await result
+            new_tweets += inserted
+            if not has_more:
+                break
+
+        except FatalSearchError as e:
+            if not resumed:
+                logger.error(f"Continuation token for '{keyword}' rejected: {e}")
+                await asyncio.to_thread(bookkeeping, reset_checkpoint, collection, keyword)
+                break
+            resumed = False
+            continuation_token, page, since = await asyncio.to_thread(restart_keyword, collection, keyword, e)
+
+        except Exception as e:
+            logger.error(f"Error processing request: {str(e)}")
+            break
+
+    if calls:
+        await asyncio.to_thread(bookkeeping, record_keyword_run, collection, keyword, calls, new_tweets)
+
+
+def run_leased(leases, keyword, crawl):
+    """持有租约时执行 crawl()；关键词被其他 worker 持有时返回 False。"""
+    if leases is None:
+        crawl()
+        return True
+    if not leases.claim(keyword):
+        return False
+    try:
+        crawl()
+    finally:
+        leases.release(keyword)
+    return True
+
+
+async def fetch_data_async(collection, counter, budget, plan, resume=False, leases=None):
+    # requests / pymongo 都是阻塞调用，放到线程池里执行（抓取线程 + 写入线程）
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=concurrency + 1))
+
+    queue = asyncio.Queue()
+    fetch_stats = StageStats("fetch")
+    write_stats = StageStats("write")
+    started = time.monotonic()
+    writer = asyncio.create_task(write_stage(queue, collection, counter, write_stats))
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def worker(keyword, categories, leased_elsewhere):
+        async with semaphore:
+            if budget.exhausted:
+                return
+            if leases and not await asyncio.to_thread(leases.claim, keyword):
+                leased_elsewhere[keyword] = categories
+                return
+            try:
+                await fetch_keyword_async(queue, fetch_stats, collection, budget, categories, keyword, resume)
+            finally:
+                if leases:
+                    await asyncio.to_thread(leases.release, keyword)
+
+    try:
+        # 被其他 worker 持有的关键词放到下一轮重试：对方翻完会被检查点跳过，对方崩溃则租约过期后接手
+        pending = plan
+        while pending and not budget.exhausted:
+            leased_elsewhere = {}
+            await asyncio.gather(*(worker(keyword, categories, leased_elsewhere)
+                                   for keyword, categories in pending.items()))
+            pending = leased_elsewhere
+            if pending:
+                logger.info(f"{len(pending)} keywords leased by other workers, retrying in {lease_retry_seconds}s")
+                await asyncio.sleep(lease_retry_seconds)
+    finally:
+        await queue.put(None)
+        await writer
+
+    elapsed = time.monotonic() - started
+    logger.info(f"Pipeline throughput over {elapsed:.1f}s - {fetch_stats.summary(elapsed)}; "
+                f"{write_stats.summary(elapsed)}")
+
+
+def fetch_data(concurrent=False, resume=False, sharded=None):
+    """抓取所有关键词；resume=True 时从检查点继续，跳过有效期内已翻完的关键词。
+
+    sharded=True 时多个 worker 通过 Mongo 里的关键词租约分摊查询计划（隐含 resume=True）。
+    """
+    global known_ids, bookkeeping_available, fast_inserts
+    bookkeeping_available = True
+    fast_inserts = False
+    sharded = shard_workers if sharded is None else sharded
+    resume = resume or sharded
     client = connect_mongodb()
     collection = client['tiktok']['twitter']
-    
+    leases = None
+
     try:
-        for category, keywords in query_categories.items():
-            # Limit to first 5 keywords for testing
-            for keyword in keywords:
-                logger.info(f"Searching: [{category}] '{keyword}'")
-                continuation_token = None
-
-                while True:
-                    params = {
-                        "query": keyword,
-                        "section": section,
-                        "start_date": start_date,
-                        "language": language,
-                        "min_retweets": min_retweets,
-                        "min_likes": min_likes,
-                        "limit": str(limit)
-                    }
-                    
-                    if continuation_token:
-                        params["continuationToken"] = continuation_token
-                        
-                    try:
-                        response = requests.get(search_url, headers=headers, params=params)
-                        
-                        # Check for API errors
-                        if response.status_code != 200:
-                            logger.error(f"API error: {response.status_code} - {response.text}")
-                            break
-                            
-                        data = response.json()
-                        tweets = data.get("results", [])
-                        continuation_token = data.get("continuation_token")
-
-                        logger.info(f"Page: {len(tweets)} tweets... token: {continuation_token}")
-
-                        inserted = insert_new_tweets(tweets, collection, category, keyword)
-                        logger.info(f"Inserted {inserted} new tweets. Total in DB: {collection.count_documents({})}")
-
-                        if inserted == 0:
-                            logger.info("No new tweets found, moving to next keyword.")
-                            break
-
-                        if not continuation_token or collection.count_documents({}) >= max_results:
-                            break
-
-                        time.sleep(1)
-
-                    except Exception as e:
-                        logger.error(f"Error processing request: {str(e)}")
+        if sharded:
+            leases = KeywordLeases(collection.database[lease_collection], ttl_seconds=lease_ttl_seconds)
+            leases.start()
+            logger.info(f"Sharded crawl as worker {leases.worker_id}")
+
+        bookkeeping(ensure_checkpoint_index, collection)
+        bookkeeping(check_unique_index, collection)
+        counter = TweetCounter(collection)
+        logger.info(f"Starting crawl with ~{counter.total} tweets in DB")
+
+        known_ids, last_id = load_known_ids(collection)
+        # 快照只记录启动时扫描到的位置，本轮新插入的文档下次启动时会被增量扫描到
+        known_ids.save(known_ids_snapshot, meta={"last_id": str(last_id) if last_id else None})
+
+        plan = plan_queries()
+        naive_searches = sum(len(keywords) for keywords in query_categories.values())
+        logger.info(f"Query plan: {len(plan)} unique queries for {naive_searches} keyword entries, "
+                    f"saving at least {naive_searches - len(plan)} API calls")
+        plan = bookkeeping(schedule_queries, collection, plan, default=plan)
+        budget = CallBudget(api_call_budget)
+        start_total = counter.total
+
+        if concurrent:
+            logger.info(f"Concurrent crawl: {concurrency} keywords in parallel, "
+                        f"up to {max_requests_per_second} req/s")
+            asyncio.run(fetch_data_async(collection, counter, budget, plan, resume, leases))
+        else:
+            pending = plan
+            while pending and not budget.exhausted:
+                leased_elsewhere = {}
+                for keyword, categories in pending.items():
+                    if budget.exhausted:
                         break
+                    crawl = partial(fetch_keyword, collection, counter, budget, categories, keyword, resume)
+                    if not run_leased(leases, keyword, crawl):
+                        leased_elsewhere[keyword] = categories
+                pending = leased_elsewhere
+                if pending:
+                    logger.info(f"{len(pending)} keywords leased by other workers, retrying in {lease_retry_seconds}s")
+                    time.sleep(lease_retry_seconds)
+
+        new_tweets = counter.total - start_total
+        logger.info(f"Run used {budget.used} API calls for {new_tweets} new tweets "
+                    f"({new_tweets / max(budget.used, 1):.2f} per call)")
 
-        logger.info("All queries done.")
+        logger.info(f"All queries done. Search cache: {search_cache.hits} hits, {search_cache.misses} misses. "
+                    f"Final request rate: {rate_limiter.rate:.2f} req/s")
+        logger.info(f"Pruned {search_cache.prune()} expired search cache entries")
+
+        if staged_writes:
+            # 暂存的推文还没进 Mongo，下次启动的增量扫描看不到它们，先记进快照
+            known_ids.save(known_ids_snapshot, meta={"last_id": str(last_id) if last_id else None})
     finally:
+        if leases:
+            leases.stop()
+        # 封存本轮的分段，loader 和归档读取只会看到完整的分段
+        staging_log.rotate()
+        raw_archive.rotate()
         client.close()
 
+def migrate_to_compact_schema():
+    client = connect_mongodb()
+    try:
+        db = client['tiktok']
+        logger.info(f"Compacted {compact_existing_tweets(db['twitter'])} documents in twitter")
+        # 分类结果集合里是 twitter 文档的副本，原始内容已经随 twitter 归档过
+        for name in ("unhandled_issues", "mishandled_issues", "non_issues"):
+            logger.info(f"Compacted {compact_existing_tweets(db[name], archive=False)} documents in {name}")
+    finally:
+        client.close()
+
+
 if __name__ == "__main__":
-    fetch_data()
+    if "--staged" in sys.argv:
+        staged_writes = True
+
+    if "--migrate-schema" in sys.argv:
+        migrate_to_compact_schema()
+    elif "--sharded" in sys.argv:
+        # 单次分片抓取；常驻的额外 worker 用 schedule.py --fetch-only，与主 worker 同一周期运行
+        fetch_data(concurrent=True, sharded=True)
+    else:
+        fetch_data()
@@ -0,0 +1,101 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# 缓存模式
+OFF = "off"        # 不读不写，直接请求 API
+RECORD = "record"  # TTL 内命中直接返回，否则请求 API 并写入缓存
+REPLAY = "replay"  # 只读缓存，不请求 API（离线重跑 / 压测用），忽略 TTL
+
+
+class ResponseCache:
+    """On-disk cache of gzip-compressed JSON response bodies, keyed by URL and normalized query params."""
+
+    def __init__(self, cache_dir, ttl_seconds=1800, mode=RECORD):
+        if mode not in (OFF, RECORD, REPLAY):
+            raise ValueError(f"Unknown cache mode: {mode}")
+        self.cache_dir = cache_dir
+        self.ttl_seconds = ttl_seconds
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def replay(self):
+        return self.mode == REPLAY
+
+    @staticmethod
+    def make_key(url, params):
+        # 参数顺序和数值类型（20 vs "20"）不影响命中
+        normalized = sorted((str(k), str(v)) for k, v in (params or {}).items() if v is not None)
+        raw = json.dumps([url, normalized], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json.gz")
+
+    def get(self, url, params):
+        """返回缓存的响应体；未命中、过期或缓存关闭时返回 None。"""
+        if self.mode == OFF:
+            return None
+
+        path = self._path(self.make_key(url, params))
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Corrupt cache entry {path}: {e}")
+            self.misses += 1
+            return None
+
+        if not self.replay and time.time() - entry.get("fetched_at", 0) > self.ttl_seconds:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return entry["body"]
+
+    def put(self, url, params, body):
+        if self.mode != RECORD:
+            return
+
+        path = self._path(self.make_key(url, params))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        entry = {"url": url, "params": params, "fetched_at": time.time(), "body": body}
+
+        # 先写临时文件再 rename，并发写同一个 key 时不会读到半个文件
+        tmp_path = f"{path}.{os.getpid()}.{time.monotonic_ns()}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def prune(self):
+        """record 模式下删除超过 TTL 的缓存文件（按修改时间判断，不用解压），返回删除的文件数。
+
+        过期的条目在 record 模式下不会再被读到，不删的话常驻 worker 的缓存目录会无限增长。
+        replay 和 off 模式不删除，录好的压测数据不受影响。
+        """
+        if self.mode != RECORD:
+            return 0
+
+        cutoff = time.time() - self.ttl_seconds
+        removed = 0
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    # 另一个进程刚好改写或删除了这个文件
+                    continue
+        return removed
@@ -0,0 +1,92 @@
+import logging
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+
+from config import (
+    DB_NAME,
+    MISHANDLED_COLLECTION,
+    NON_ISSUE_COLLECTION,
+    RETRY_COLLECTION,
+    TWITTER_COLLECTION,
+    UNHANDLED_COLLECTION,
+)
+
+logger = logging.getLogger(__name__)
+
+# 分类结果集合：看板按日期范围读取，再按 category 分组
+ISSUE_INDEXES = [
+    ([("tweet_id", ASCENDING)], {"unique": True}),
+    ([("creation_date", DESCENDING)], {}),
+    ([("category", ASCENDING), ("creation_date", DESCENDING)], {}),
+]
+
+INDEXES = {
+    TWITTER_COLLECTION: [
+        # fetchdata 的 upsert 按 tweet_id 匹配
+        ([("tweet_id", ASCENDING)], {"unique": True}),
+        ([("creation_date", DESCENDING)], {}),
+        ([("category", ASCENDING), ("creation_date", DESCENDING)], {}),
+        # picking 的待分类队列：{label: null} 按 _id 顺序读取，只扫描未分类的推文
+        ([("label", ASCENDING), ("_id", ASCENDING)], {}),
+    ],
+    UNHANDLED_COLLECTION: ISSUE_INDEXES,
+    MISHANDLED_COLLECTION: ISSUE_INDEXES,
+    NON_ISSUE_COLLECTION: ISSUE_INDEXES,
+    # picking 的快速重试按到期时间读取待重试的推文
+    RETRY_COLLECTION: [
+        ([("status", ASCENDING), ("next_eligible_at", ASCENDING)], {}),
+    ],
+}
+
+
+def ensure_indexes(db):
+    """创建项目用到的所有索引（已存在时为空操作），worker 和看板启动时各调用一次。"""
+    for collection_name, indexes in INDEXES.items():
+        for keys, options in indexes:
+            try:
+                db[collection_name].create_index(keys, **options)
+            except OperationFailure as e:
+                # 最常见的是历史数据里有重复 tweet_id，唯一索引建不起来；不影响其他索引
+                logger.error(f"Failed to create index {keys} on {collection_name}: {e}")
+
+
+def index_report(db):
+    """返回每个索引的大小和自上次重启以来的使用次数。"""
+    rows = []
+    for collection_name in INDEXES:
+        collection = db[collection_name]
+        try:
+            sizes = db.command("collStats", collection_name).get("indexSizes", {})
+            usage = {stat["name"]: stat["accesses"]["ops"] for stat in collection.aggregate([{"$indexStats": {}}])}
+        except OperationFailure as e:
+            logger.warning(f"Index stats unavailable for {collection_name}: {e}")
+            continue
+
+        for name, size in sizes.items():
+            rows.append({
+                "collection": collection_name,
+                "index": name,
+                "size_mb": round(size / 1024 / 1024, 2),
+                "ops": usage.get(name, 0),
+            })
+    return rows
+
+
+def log_index_report(db):
+    for row in index_report(db):
+        logger.info(f"Index {row['collection']}.{row['index']}: {row['size_mb']} MB, {row['ops']} ops")
+
+
+if __name__ == "__main__":
+    from pymongo import MongoClient
+    from config import MONGO_URI
+
+    logging.basicConfig(level=logging.INFO)
+    client = MongoClient(MONGO_URI)
+    try:
+        db = client[DB_NAME]
+        ensure_indexes(db)
+        log_index_report(db)
+    finally:
+        client.close()
@@ -0,0 +1,101 @@
+import logging
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+
+def default_worker_id():
+    return os.getenv("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+
+
+class KeywordLeases:
+    """Mongo-backed keyword leases, so several crawl workers can split the keyword plan.
+
+    A lease is a document {_id: keyword, owner, expires_at}. Claiming succeeds when the
+    keyword is unleased, already ours, or its lease has expired (its owner crashed or
+    stopped heartbeating). A background thread extends every lease this worker holds.
+    """
+
+    def __init__(self, collection, worker_id=None, ttl_seconds=120):
+        self.collection = collection
+        self.worker_id = worker_id or default_worker_id()
+        self.ttl_seconds = ttl_seconds
+        self.held = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def ensure_index(self):
+        # 过期很久的租约由 TTL 索引清理；是否可抢占只看 expires_at，与 TTL 清理时机无关
+        self.collection.create_index("expires_at", expireAfterSeconds=self.ttl_seconds)
+
+    def claim(self, keyword):
+        """尝试获得关键词的租约；被其他 worker 持有且未过期时返回 False。"""
+        now = datetime.utcnow()
+        try:
+            self.collection.find_one_and_update(
+                {"_id": keyword, "$or": [{"owner": self.worker_id}, {"expires_at": {"$lt": now}}]},
+                {"$set": {
+                    "owner": self.worker_id,
+                    "expires_at": now + timedelta(seconds=self.ttl_seconds),
+                    "heartbeat_at": now,
+                }},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # 文档存在但条件不满足 → upsert 撞上 _id，说明租约在别人手里
+            return False
+
+        with self._lock:
+            self.held.add(keyword)
+        return True
+
+    def release(self, keyword):
+        with self._lock:
+            self.held.discard(keyword)
+        self.collection.delete_one({"_id": keyword, "owner": self.worker_id})
+
+    def heartbeat(self):
+        with self._lock:
+            held = list(self.held)
+        if not held:
+            return
+
+        now = datetime.utcnow()
+        result = self.collection.update_many(
+            {"_id": {"$in": held}, "owner": self.worker_id},
+            {"$set": {"expires_at": now + timedelta(seconds=self.ttl_seconds), "heartbeat_at": now}},
+        )
+        if result.matched_count < len(held):
+            logger.warning(f"Worker {self.worker_id} lost {len(held) - result.matched_count} keyword leases")
+
+    def _heartbeat_loop(self):
+        while not self._stop.wait(self.ttl_seconds / 3):
+            try:
+                self.heartbeat()
+            except Exception as e:
+                logger.error(f"Lease heartbeat failed: {e}")
+
+    def start(self):
+        self.ensure_index()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._heartbeat_loop, name="lease-heartbeat", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止心跳并释放所有仍持有的租约。"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        with self._lock:
+            held = list(self.held)
+            self.held.clear()
+        if held:
+            self.collection.delete_many({"_id": {"$in": held}, "owner": self.worker_id})
@@ -0,0 +1,109 @@
+import bisect
+import threading
+import time
+from datetime import datetime
+
+import openai
+
+llm_calls_collection = "llm_calls"
+
+# 美元 / 百万 token：(输入, 输出)
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+}
+
+# 延迟直方图的桶上界（秒），最后一个桶收集更慢的调用
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2, 4, 8, 16, 32)
+
+
+def call_cost(model, prompt_tokens, completion_tokens):
+    input_price, output_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+class LLMCallStats:
+    """Token, cost, latency and retry accounting for ChatCompletion calls.
+
+    Every attempt (including retries) goes through `chat_completion`, is kept in memory for
+    the run report and, when a collection is given, recorded in `llm_calls` in small batches.
+    """
+
+    def __init__(self, collection=None, flush_size=50):
+        self.collection = collection
+        self.flush_size = flush_size
+        self.latencies = []
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.calls = self.failures = self.retries = 0
+        self.prompt_tokens = self.completion_tokens = 0
+        self.cost = 0.0
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def record(self, purpose, model, latency, retry, usage=None, items=1, error=None):
+        usage = usage or {}
+        prompt_tokens = usage.get("prompt_tokens", 0)
+        completion_tokens = usage.get("completion_tokens", 0)
+        cost = call_cost(model, prompt_tokens, completion_tokens)
+
+        with self._lock:
+            self.calls += 1
+            self.failures += error is not None
+            self.retries += retry > 0
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.cost += cost
+            bisect.insort(self.latencies, latency)
+            self.histogram[bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+            self._pending.append({
+                "purpose": purpose,
+                "model": model,
+                "items": items,
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "cost_usd": cost,
+                "latency_seconds": latency,
+                "retry": retry,
+                "error": error,
+                "called_at": datetime.utcnow(),
+            })
+            flush = len(self._pending) >= self.flush_size
+        if flush:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if pending and self.collection is not None:
+            self.collection.insert_many(pending, ordered=False)
+
+    def chat_completion(self, purpose, items=1, retry=0, **kwargs):
+        """openai.ChatCompletion.create 的薄包装：记录本次尝试的耗时、token 和是否是重试。"""
+        model = kwargs.get("model")
+        started = time.monotonic()
+        try:
+            response = openai.ChatCompletion.create(**kwargs)
+        except Exception as e:
+            self.record(purpose, model, time.monotonic() - started, retry, items=items, error=type(e).__name__)
+            raise
+        self.record(purpose, model, time.monotonic() - started, retry, response.get("usage"), items)
+        return response
+
+    def report(self, tweets):
+        """本轮汇总：延迟分位数和直方图、每条推文的 token 数、每千条推文的成本。"""
+        total_tokens = self.prompt_tokens + self.completion_tokens
+        labels = [f"≤{bound}s" for bound in LATENCY_BUCKETS] + [f">{LATENCY_BUCKETS[-1]}s"]
+        histogram = ", ".join(f"{label}: {count}" for label, count in zip(labels, self.histogram) if count)
+        return [
+            f"LLM calls: {self.calls} ({self.retries} retries, {self.failures} failed)",
+            f"Latency p50 {percentile(self.latencies, 0.5):.2f}s, p95 {percentile(self.latencies, 0.95):.2f}s"
+            + (f" [{histogram}]" if histogram else ""),
+            f"Tokens: {self.prompt_tokens} prompt + {self.completion_tokens} completion, "
+            f"{total_tokens / max(tweets, 1):.1f} per tweet",
+            f"Cost: ${self.cost:.4f}, ${self.cost / max(tweets, 1) * 1000:.4f} per 1k tweets",
+        ]
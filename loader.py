@@ -0,0 +1,136 @@
+import logging
+import os
+import sys
+
+from pymongo import UpdateOne
+
+import fetchdata
+from config import DB_NAME, TWITTER_COLLECTION
+from indexes import INDEXES
+from segmentlog import SegmentLog
+
+logger = logging.getLogger(__name__)
+
+load_batch_size = 5000  # 每次 bulk_write 的推文数，导入不受 API 延迟影响，可以比抓取时大得多
+stale_segment_seconds = 3600  # .open 分段超过这个时间没有写入，视为写入进程已退出，由 loader 封存
+
+# 不在日志里、由其他任务写到 twitter 上的字段：重建后从旧集合合并过来
+CARRIED_FIELDS = (
+    "favorite_count", "retweet_count", "engagement_refreshed_at", "engagement_checked_at",
+    "label", "classified_at", "retry",
+)
+
+# 导入完成的分段移到这里保留，重建集合时连同未导入的分段一起重放
+loaded_log = SegmentLog(os.path.join(fetchdata.staging_log.directory, "loaded"), prefix=fetchdata.staging_log.prefix)
+
+
+def load_segment(collection, path, archive=True):
+    """把一个分段里的页面按 load_batch_size 合并成 bulk_write 导入，返回 (新插入数, 更新数)。"""
+    inserted = updated = 0
+    writes = []
+    pending = set()
+
+    def flush():
+        nonlocal inserted, updated
+        if writes:
+            batch_inserted, batch_updated = fetchdata.run_writes(collection, writes, archive=archive)
+            inserted, updated = inserted + len(batch_inserted), updated + batch_updated
+            writes.clear()
+
+    for record in SegmentLog.read(path):
+        writes.extend(fetchdata.build_writes(record["results"], record["categories"], record["keyword"], pending))
+        if len(writes) >= load_batch_size:
+            flush()
+    flush()
+    return inserted, updated
+
+
+def load_staged_pages():
+    """导入所有已封存、尚未导入的预写日志分段，导入后移到 loaded/。写入都是幂等的，中途失败可以直接重跑。"""
+    client = fetchdata.connect_mongodb()
+    collection = client[DB_NAME][TWITTER_COLLECTION]
+    staging_log = fetchdata.staging_log
+
+    try:
+        fetchdata.check_unique_index(collection)
+        sealed = staging_log.seal_stale(stale_segment_seconds)
+        if sealed:
+            logger.warning(f"Sealed {sealed} staging segments left open by exited writers")
+
+        os.makedirs(loaded_log.directory, exist_ok=True)
+        total_inserted = total_updated = 0
+        segments = staging_log.segments()
+        for path in segments:
+            inserted, updated = load_segment(collection, path)
+            os.replace(path, os.path.join(loaded_log.directory, os.path.basename(path)))
+            total_inserted, total_updated = total_inserted + inserted, total_updated + updated
+            logger.info(f"Loaded {os.path.basename(path)}: inserted {inserted}, updated {updated}")
+
+        logger.info(f"Loaded {len(segments)} staging segments: inserted {total_inserted} new tweets, "
+                    f"updated {total_updated} existing tweets")
+    finally:
+        # 导入时新推文的原始内容写进了归档，封存分段
+        fetchdata.raw_archive.rotate()
+        client.close()
+
+
+def carry_over_state(source, target, batch_size=1000):
+    """把 source 上的互动数、分类状态按 tweet_id 合并到 target，返回更新的文档数。"""
+    projection = {"_id": 0, "tweet_id": 1, **{field: 1 for field in CARRIED_FIELDS}}
+    merged = 0
+    operations = []
+    for doc in source.find({}, projection).batch_size(batch_size):
+        fields = {field: doc[field] for field in CARRIED_FIELDS if field in doc}
+        if not fields or not doc.get("tweet_id"):
+            continue
+        operations.append(UpdateOne({"tweet_id": doc["tweet_id"]}, {"$set": fields}))
+        if len(operations) >= batch_size:
+            merged += target.bulk_write(operations, ordered=False).modified_count
+            operations = []
+    if operations:
+        merged += target.bulk_write(operations, ordered=False).modified_count
+    return merged
+
+
+def rebuild_from_log(target=f"{TWITTER_COLLECTION}_rebuild", swap=False):
+    """从全部预写日志（已导入和未导入的分段）重放出一个新集合，用于改了入库结构之后重建数据。
+
+    swap=True 时先把 twitter 上的互动数和分类状态合并过来，再用重建结果替换 twitter；
+    重建出的推文比 twitter 少（例如有推文不是经由预写日志写入的）时拒绝替换。
+    """
+    client = fetchdata.connect_mongodb()
+    db = client[DB_NAME]
+
+    try:
+        collection = db[target]
+        for keys, options in INDEXES[TWITTER_COLLECTION]:
+            collection.create_index(keys, **options)
+        fetchdata.check_unique_index(collection)
+
+        total_inserted = 0
+        segments = sorted(loaded_log.segments() + fetchdata.staging_log.segments(), key=os.path.basename)
+        for path in segments:
+            # 原始内容在第一次导入时已经归档过
+            inserted, _ = load_segment(collection, path, archive=False)
+            total_inserted += inserted
+        logger.info(f"Rebuilt {target} from {len(segments)} staging segments: {total_inserted} tweets")
+
+        if swap:
+            current = db[TWITTER_COLLECTION]
+            rebuilt_count, current_count = collection.count_documents({}), current.count_documents({})
+            if rebuilt_count < current_count:
+                logger.error(f"Not replacing {TWITTER_COLLECTION}: {target} has {rebuilt_count} tweets, "
+                             f"{TWITTER_COLLECTION} has {current_count}; some tweets were not written through the staging log")
+                return
+            logger.info(f"Carried over engagement and classification state for {carry_over_state(current, collection)} tweets")
+            collection.rename(TWITTER_COLLECTION, dropTarget=True)
+            logger.info(f"Replaced {TWITTER_COLLECTION} with {target}")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    if "--rebuild" in sys.argv:
+        rebuild_from_log(swap="--swap" in sys.argv)
+    else:
+        load_staged_pages()
@@ -1,7 +1,22 @@
 import os
+import re
+import sys
+import json
+import hashlib
+import random
+import time
+import threading
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
 import openai
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
 from dotenv import load_dotenv
+from config import RETRY_COLLECTION
+from llmstats import LLMCallStats, llm_calls_collection
+from prefilter import PreFilter, max_examples_per_label
+from ratelimit import MinuteBudget
+from searchclient import parse_retry_after
 
 # Load environment variables from .env file
 load_dotenv()
@@ -12,25 +27,107 @@ openai.api_key = os.getenv("OPENAI_API_KEY")
 # MongoDB URI from the .env file
 MONGO_URI = os.getenv("MONGO_URI")
 
+# 批量分类：每个请求分类多少条推文，指令只发送一次
+classify_batch_size = 20
+
+# 并发分类配置
+classify_concurrency = 4  # 同时在途的分类请求数
+requests_per_minute = 500  # OpenAI 账号的 RPM 上限
+tokens_per_minute = 200000  # OpenAI 账号的 TPM 上限
+max_retries = 5  # 429 / 超时 / 5xx 的最大重试次数
+backoff_base = 1.0
+backoff_max = 60.0
+
+# 待分类推文：源文档上还没有 label 的；游标每次从 Mongo 取 backlog_batch_size 条
+# 在重试队列里的推文（retry=True）由重试流程处理
+BACKLOG_QUERY = {"label": None, "retry": {"$ne": True}, "tweet_id": {"$ne": None}, "text": {"$nin": [None, ""]}}
+backlog_batch_size = 500
+migrations_collection = "migrations"  # 一次性迁移的完成标记
+
+# 分类结果按目标集合缓冲，攒够 result_flush_size 条或距上次写入超过 result_flush_seconds 秒时批量写入
+result_flush_size = 200
+result_flush_seconds = 5.0
+
+# 分类失败的推文进入重试队列，按指数退避重试，超过次数后标记为 poison 不再重试
+max_classification_attempts = 5
+retry_backoff_base = timedelta(minutes=5)  # 第 n 次失败后等待 base * 2^(n-1)
+retry_backoff_max = timedelta(hours=12)
+retry_pass_limit = 1000  # 每次快速重试最多处理的推文数
+retry_pass_minutes = 15  # schedule.py 里快速重试的间隔
+
+# 主流程和快速重试不同时运行（共用 llm_stats 和预算）
+classification_lock = threading.Lock()
+
+# 标签缓存：按规范化文本的哈希记录标签，转推、复制粘贴的相同内容只调用一次模型
+label_cache_collection = "label_cache"
+
+# 本轮所有 ChatCompletion 调用的 token / 延迟 / 重试统计，classify_and_store 开始时重置
+llm_stats = LLMCallStats()
+
+# 所有分类线程共享的 RPM / TPM 预算
+request_budget = MinuteBudget(requests_per_minute)
+token_budget = MinuteBudget(tokens_per_minute)
+
+RETRYABLE_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.Timeout,
+    openai.error.APIConnectionError,
+    openai.error.ServiceUnavailableError,
+    openai.error.APIError,
+)
+
+LABEL_DEFINITIONS = (
+    "1 = Ecosystem Issue: User reports problems like impersonation, scams, or harmful content that TikTok hasn't addressed. Examples: fake accounts, stolen content, impersonation, scams, harmful challenges, etc.\n\n"
+    "2 = Mishandled Issue: TikTok's action made things worse. Examples: wrong account bans, unfair content removal, or when reporting made the problem worse.\n\n"
+    "3 = Non-Issue: User is just sharing content, promoting something, or making general comments without reporting any problems.\n\n"
+)
+
 def connect_mongodb():
     return MongoClient(MONGO_URI)
 
+def estimate_tokens(prompt, expected_output_tokens):
+    # 粗略按 4 个字符 1 个 token 估算，只用于 TPM 预算
+    return len(prompt) // 4 + expected_output_tokens
+
+def chat_completion(prompt, expected_output_tokens=1, purpose="classify", items=1, **kwargs):
+    """调用 ChatCompletion：先占用 RPM / TPM 预算，429 和临时故障按退避重试（优先遵守 Retry-After）。
+
+    每次尝试都经过 llm_stats 记录耗时和 token。
+    """
+    attempt = 0
+    while True:
+        request_budget.acquire()
+        token_budget.acquire(estimate_tokens(prompt, expected_output_tokens))
+        try:
+            return llm_stats.chat_completion(
+                purpose,
+                items,
+                retry=attempt,
+                model="gpt-4o-mini",
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.2,
+                **kwargs
+            )
+        except RETRYABLE_ERRORS as e:
+            if attempt >= max_retries:
+                raise
+            retry_after = parse_retry_after((e.headers or {}).get("retry-after"))
+            delay = min(retry_after, backoff_max) if retry_after is not None else random.uniform(
+                0, min(backoff_max, backoff_base * (2 ** attempt)))
+            print(f"\n⏳ OpenAI error ({e}), retrying in {delay:.1f}s")
+            attempt += 1
+            time.sleep(delay)
+
 def classify_issue(text):
     prompt = (
         "As a TikTok Governance PM, analyze this user comment and classify it:\n\n"
-        "1 = Ecosystem Issue: User reports problems like impersonation, scams, or harmful content that TikTok hasn't addressed. Examples: fake accounts, stolen content, impersonation, scams, harmful challenges, etc.\n\n"
-        "2 = Mishandled Issue: TikTok's action made things worse. Examples: wrong account bans, unfair content removal, or when reporting made the problem worse.\n\n"
-        "3 = Non-Issue: User is just sharing content, promoting something, or making general comments without reporting any problems.\n\n"
+        + LABEL_DEFINITIONS +
         f"Comment:\n{text}\n\n"
         "You must respond with either 1, 2, or 3. Only number is allowes, No other responses are allowed, Do NOT include any explanation, punctuation, or other text."
     )
 
     try:
-        response = openai.ChatCompletion.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.2
-        )
+        response = chat_completion(prompt)
         answer = response['choices'][0]['message']['content'].strip()
         if answer == "1":
             return 1
@@ -45,7 +142,270 @@ def classify_issue(text):
         print(f"Comment text: {text[:100]}...")
         raise  # 重新抛出异常，让外层处理
 
+def parse_batch_labels(answer, count):
+    """校验批量结果：必须是 {"labels": {"1": 1|2|3, ...}}，编号 1..count 一个不多一个不少。"""
+    try:
+        labels = json.loads(answer)["labels"]
+    except (ValueError, KeyError, TypeError):
+        raise ValueError(f"Malformed batch response: {answer[:200]}")
+
+    expected = {str(i) for i in range(1, count + 1)}
+    if not isinstance(labels, dict) or set(labels) != expected:
+        raise ValueError(f"Batch response ids do not match the {count} comments: {answer[:200]}")
+
+    result = []
+    for i in range(1, count + 1):
+        label = labels[str(i)]
+        if isinstance(label, str) and label.strip() in ("1", "2", "3"):
+            label = int(label)
+        if isinstance(label, bool) or label not in (1, 2, 3):
+            raise ValueError(f"Invalid label for comment {i}: {label!r}")
+        result.append(label)
+    return result
+
+def classify_batch(texts):
+    """一次请求分类多条推文，按输入顺序返回标签列表；返回格式不对时抛出 ValueError。"""
+    comments = "\n\n".join(f"[{i}] {text}" for i, text in enumerate(texts, start=1))
+    prompt = (
+        "As a TikTok Governance PM, analyze each of the numbered user comments below and classify it:\n\n"
+        + LABEL_DEFINITIONS +
+        f"Comments:\n{comments}\n\n"
+        f"Respond with a JSON object mapping every comment number to its label, for example "
+        f'{{"labels": {{"1": 3, "2": 1}}}}. Include all {len(texts)} comments. Labels must be 1, 2, or 3. '
+        "Do NOT include any explanation or other text."
+    )
+
+    # 每条结果约 6 个 token（"12": 3,）
+    response = chat_completion(prompt, expected_output_tokens=6 * len(texts) + 10,
+                               purpose="classify_batch", items=len(texts),
+                               response_format={"type": "json_object"})
+    answer = response['choices'][0]['message']['content'].strip()
+    return parse_batch_labels(answer, len(texts))
+
+def classify_texts(texts):
+    """批量分类；某批结果格式不对时二分重试，拆到单条时退回 classify_issue，单条也失败的返回 None。"""
+    if len(texts) == 1:
+        try:
+            return [classify_issue(texts[0])]
+        except ValueError:
+            return [None]
+    try:
+        return classify_batch(texts)
+    except ValueError as e:
+        middle = len(texts) // 2
+        print(f"\n⚠️ Batch of {len(texts)} failed validation ({e}), splitting into {middle} + {len(texts) - middle}")
+        return classify_texts(texts[:middle]) + classify_texts(texts[middle:])
+
+URL_PATTERN = re.compile(r"https?://\S+")
+RETWEET_PREFIX = re.compile(r"^rt @\w+:\s*")
+
+def normalize_text(text):
+    """缓存键用的规范化文本：去掉链接和转推前缀，统一大小写和空白。"""
+    text = URL_PATTERN.sub(" ", text.lower())
+    text = " ".join(text.split())
+    return RETWEET_PREFIX.sub("", text)
+
+def text_key(text):
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+def load_prefilter(collections, threshold=None):
+    """用已有的 LLM 标签训练本地预筛模型（不含预筛自己打的标签，避免自我强化）。"""
+    texts, labels = [], []
+    for label, collection in collections.items():
+        cursor = collection.find(
+            {"label_source": {"$ne": "prefilter"}, "text": {"$type": "string"}}, {"_id": 0, "text": 1}
+        ).limit(max_examples_per_label)
+        for doc in cursor:
+            texts.append(doc["text"])
+            labels.append(label)
+
+    prefilter = PreFilter(threshold, preprocessor=normalize_text)
+    if not prefilter.fit(texts, labels):
+        print(f"🤖 Pre-filter disabled: only {len(texts)} labelled tweets (or a label is missing)")
+    elif prefilter.holdout_agreement is None:
+        print(f"🤖 Pre-filter trained on {len(texts)} tweets, but no holdout tweet reached threshold {prefilter.threshold}")
+    else:
+        print(f"🤖 Pre-filter trained on {len(texts)} tweets: threshold {prefilter.threshold}, "
+              f"holdout coverage {prefilter.holdout_coverage:.1%}, agreement with LLM {prefilter.holdout_agreement:.1%}")
+    return prefilter
+
+def classify_cached(cache, texts, prefilter=None):
+    """先查标签缓存，再让本地预筛模型处理有把握的文本，剩下的（批内去重后）交给 LLM，LLM 的新标签写回缓存。
+
+    返回 (标签列表, 来源列表)，来源是 "cache" / "prefilter" / "llm"。
+    """
+    keys = [text_key(text) for text in texts]
+    cached = {doc["_id"]: doc["label"] for doc in cache.find({"_id": {"$in": list(set(keys))}})}
+    sources = {key: "cache" for key in cached}
+
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key not in cached:
+            missing.setdefault(key, text)
+
+    if missing and prefilter is not None:
+        for key, label in zip(list(missing), prefilter.predict(list(missing.values()))):
+            if label is not None:
+                cached[key] = label
+                sources[key] = "prefilter"
+                del missing[key]
+
+    if missing:
+        fresh = dict(zip(missing, classify_texts(list(missing.values()))))
+        sources.update((key, "llm") for key in fresh)
+        now = datetime.utcnow()
+        updates = [
+            UpdateOne({"_id": key}, {"$set": {"label": label, "updated_at": now}}, upsert=True)
+            for key, label in fresh.items() if label is not None
+        ]
+        if updates:
+            cache.bulk_write(updates, ordered=False)
+        cached.update(fresh)
+
+    return [cached[key] for key in keys], [sources[key] for key in keys]
+
+def backfill_labels(source_collection, collections, batch_size=1000):
+    """一次性迁移：把结果集合里已有的分类写回源文档的 label，避免升级后重新分类全部历史推文。"""
+    now = datetime.utcnow()
+    backfilled = 0
+    for label, collection in collections.items():
+        marks = []
+        for doc in collection.find({}, {"_id": 0, "tweet_id": 1}).batch_size(batch_size):
+            marks.append(UpdateOne(
+                {"tweet_id": doc.get("tweet_id"), "label": None},
+                {"$set": {"label": label, "classified_at": now}},
+            ))
+            if len(marks) >= batch_size:
+                backfilled += source_collection.bulk_write(marks, ordered=False).modified_count
+                marks = []
+        if marks:
+            backfilled += source_collection.bulk_write(marks, ordered=False).modified_count
+    if backfilled:
+        print(f"🔄 Backfilled labels on {backfilled} previously classified tweets")
+
+class RetryQueue:
+    """Dead-letter queue for tweets whose classification failed.
+
+    One entry per tweet with the last failure reason, the attempt count and when it is next
+    eligible for the retry pass. The delay doubles with every failure; after
+    `max_classification_attempts` the tweet is parked as poison and left for a human to look at.
+    """
+
+    def __init__(self, collection, source_collection):
+        self.collection = collection
+        self.source_collection = source_collection
+        self.queued = 0
+        self.parked = 0
+
+    def record_failures(self, tweets, reason):
+        ids = [tweet["_id"] for tweet in tweets]
+        attempts = {doc["_id"]: doc.get("attempts", 0) for doc in self.collection.find({"_id": {"$in": ids}}, {"attempts": 1})}
+
+        now = datetime.utcnow()
+        operations = []
+        for tweet in tweets:
+            attempt = attempts.get(tweet["_id"], 0) + 1
+            poison = attempt >= max_classification_attempts
+            delay = min(retry_backoff_max, retry_backoff_base * (2 ** (attempt - 1)))
+            operations.append(UpdateOne(
+                {"_id": tweet["_id"]},
+                {
+                    "$set": {
+                        "tweet_id": tweet.get("tweet_id"),
+                        "reason": reason[:500],
+                        "attempts": attempt,
+                        "status": "poison" if poison else "pending",
+                        "next_eligible_at": None if poison else now + delay,
+                        "last_failed_at": now,
+                    },
+                    "$setOnInsert": {"first_failed_at": now},
+                },
+                upsert=True,
+            ))
+            if poison:
+                self.parked += 1
+            else:
+                self.queued += 1
+
+        self.collection.bulk_write(operations, ordered=False)
+        # 源文档打上 retry 标记，主流程的待分类查询不再读取它
+        self.source_collection.update_many({"_id": {"$in": ids}}, {"$set": {"retry": True}})
+
+    def resolve(self, ids):
+        ids = list(ids)
+        if ids:
+            self.collection.delete_many({"_id": {"$in": ids}})
+
+    def due(self, limit):
+        return self.collection.find(
+            {"status": "pending", "next_eligible_at": {"$lte": datetime.utcnow()}}, {"_id": 1}
+        ).sort("next_eligible_at", 1).limit(limit)
+
+class ResultWriter:
+    """Buffers classified tweets per target collection and writes them with one insert_many each.
+
+    A tweet's label is only set on its source document after the copy has been stored, so a
+    crash between the two at worst classifies the tweet again; the duplicate insert is ignored.
+    """
+
+    STORED_MESSAGES = {1: "✅ Stored {} as Unhandled Issues", 2: "⚠️ Stored {} as Mishandled Issues", 3: "📢 Stored {} as Non-Issues"}
+
+    def __init__(self, source_collection, collections, retries=None, flush_size=None, flush_seconds=None):
+        self.source_collection = source_collection
+        self.collections = collections
+        self.retries = retries
+        self.flush_size = result_flush_size if flush_size is None else flush_size
+        self.flush_seconds = result_flush_seconds if flush_seconds is None else flush_seconds
+        self.buffers = {issue_type: [] for issue_type in collections}
+        self.duplicates = 0
+        self._last_flush = time.monotonic()
+
+    def add(self, issue_type, tweet):
+        self.buffers[issue_type].append(tweet)
+        if (sum(len(docs) for docs in self.buffers.values()) >= self.flush_size
+                or time.monotonic() - self._last_flush >= self.flush_seconds):
+            self.flush()
+
+    def _insert(self, collection, docs):
+        # 无序写入；tweet_id 唯一索引上的重复键说明这条已经存过（上次中断或并发运行），直接忽略
+        try:
+            collection.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if any(error["code"] != 11000 for error in errors):
+                raise
+            self.duplicates += len(errors)
+
+    def flush(self):
+        now = datetime.utcnow()
+        marks = []
+        stored_ids = []
+        for issue_type, docs in self.buffers.items():
+            if not docs:
+                continue
+            self._insert(self.collections[issue_type], docs)
+            print(self.STORED_MESSAGES[issue_type].format(len(docs)))
+            marks.extend(
+                UpdateOne(
+                    {"_id": tweet["_id"]},
+                    {"$set": {"label": issue_type, "classified_at": now}, "$unset": {"retry": ""}},
+                )
+                for tweet in docs
+            )
+            stored_ids.extend(tweet["_id"] for tweet in docs)
+            self.buffers[issue_type] = []
+
+        if marks:
+            self.source_collection.bulk_write(marks, ordered=False)
+            if self.retries is not None:
+                self.retries.resolve(stored_ids)
+        self._last_flush = time.monotonic()
+
 def classify_and_store():
+    with classification_lock:
+        classify_backlog()
+
+def classify_backlog():
     # Connect to MongoDB and access collections
     client = connect_mongodb()
     source_collection = client["tiktok"]["twitter"]  # 改为与fetchdata.py相同的集合
@@ -53,73 +413,166 @@ def classify_and_store():
     mishandled_collection = client["tiktok"]["mishandled_issues"]  # 处理不当问题
     non_issue_collection = client["tiktok"]["non_issues"]  # 新增：非问题内容
 
-    # 获取已处理的推文ID
-    processed_ids = set()
-    processed_ids.update(unhandled_collection.distinct("tweet_id"))
-    processed_ids.update(mishandled_collection.distinct("tweet_id"))
-    processed_ids.update(non_issue_collection.distinct("tweet_id"))
-    
-    print(f"Found {len(processed_ids)} already processed tweets")
+    collections = {1: unhandled_collection, 2: mishandled_collection, 3: non_issue_collection}
+
+    # 分类状态记在源文档的 label 上，只读取还没分类的推文（走 label + _id 索引）。
+    # 回填完成后写入标记文档；中途中断的话下次继续回填（只更新还没有 label 的文档）
+    migrations = client["tiktok"][migrations_collection]
+    if migrations.find_one({"_id": "label_backfill"}) is None:
+        backfill_labels(source_collection, collections)
+        migrations.update_one({"_id": "label_backfill"}, {"$set": {"completed_at": datetime.utcnow()}}, upsert=True)
+    print(f"Found {source_collection.count_documents(BACKLOG_QUERY)} unclassified tweets")
+
+    tweets = source_collection.find(BACKLOG_QUERY, {"retry": 0}).sort("_id", 1).batch_size(backlog_batch_size)
+    retries = RetryQueue(client["tiktok"][RETRY_COLLECTION], source_collection)
+    run_classification(client["tiktok"], source_collection, collections, retries, tweets,
+                       load_prefilter(collections), "Classification Summary")
+
+def run_classification(db, source_collection, collections, retries, tweets, prefilter, title):
+    """并发分类 tweets 并写入结果集合，失败的推文进入重试队列，最后打印汇总。"""
+    global llm_stats
+    label_cache = db[label_cache_collection]
+    llm_stats = LLMCallStats(db[llm_calls_collection])
 
-    tweets = source_collection.find()
     unhandled_count = 0
     mishandled_count = 0
     non_issue_count = 0
     error_count = 0
-    duplicate_count = 0
-
-    for tweet in tweets:
-        tweet_id = tweet.get("tweet_id")
-        if not tweet_id:
-            continue
-            
-        if tweet_id in processed_ids:
-            duplicate_count += 1
-            continue
-            
-        text = tweet.get("text", "")
-        if not text:
-            continue
-        
+    cache_hits = 0
+    cache_lookups = 0
+    prefiltered_count = 0
+
+    writer = ResultWriter(source_collection, collections, retries)
+
+    def store_results(batch, future):
+        """批次完成的先后顺序不固定，结果交给 writer 按目标集合缓冲、批量写入。"""
+        nonlocal unhandled_count, mishandled_count, non_issue_count, error_count, cache_hits, cache_lookups
+        nonlocal prefiltered_count
         try:
-            issue_type = classify_issue(text)
-            
+            labels, sources = future.result()
+        except Exception as e:
+            error_count += len(batch)
+            print(f"\n❌ Failed to process a batch of {len(batch)} tweets")
+            print(f"Error: {str(e)}")
+            retries.record_failures(batch, f"{type(e).__name__}: {e}")
+            return
+
+        cache_hits += sources.count("cache")
+        cache_lookups += len(batch)
+        prefiltered_count += sources.count("prefilter")
+        failed = []
+        for tweet, issue_type, source in zip(batch, labels, sources):
+            tweet_id = tweet.get("tweet_id")
+            if issue_type is None:
+                error_count += 1
+                failed.append(tweet)
+                print(f"\n❌ Failed to process tweet {tweet_id}")
+                continue
+
             print("\n" + "="*80)
             print(f"Tweet ID: {tweet_id}")
-            print(f"Category: {issue_type}")
-            print(f"Full Text: {text}")
+            print(f"Category: {issue_type} ({source})")
+            print(f"Full Text: {tweet.get('text', '')}")
             print("="*80 + "\n")
-            
-            if issue_type == 1:  # 未处理问题
-                unhandled_collection.insert_one(tweet)
+            writer.add(issue_type, {**tweet, "label_source": source})
+            if issue_type == 1:
                 unhandled_count += 1
-                processed_ids.add(tweet_id)
-                print(f"✅ Stored as Unhandled Issue")
-            elif issue_type == 2:  # 处理不当问题
-                mishandled_collection.insert_one(tweet)
+            elif issue_type == 2:
                 mishandled_count += 1
-                processed_ids.add(tweet_id)
-                print(f"⚠️ Stored as Mishandled Issue")
-            else:  # 非问题内容
-                non_issue_collection.insert_one(tweet)
+            else:
                 non_issue_count += 1
-                processed_ids.add(tweet_id)
-                print(f"📢 Stored as Non-Issue")
-        except Exception as e:
-            error_count += 1
-            print(f"\n❌ Failed to process tweet {tweet_id}")
-            print(f"Error: {str(e)}")
-            continue
+        if failed:
+            retries.record_failures(failed, "invalid_response")
+
+    in_flight = {}
+
+    def drain(return_when):
+        done, _ = wait(in_flight, return_when=return_when)
+        for future in done:
+            store_results(in_flight.pop(future), future)
+
+    executor = ThreadPoolExecutor(max_workers=classify_concurrency)
+    try:
+        def submit(batch):
+            in_flight[executor.submit(classify_cached, label_cache, [tweet.get("text", "") for tweet in batch], prefilter)] = batch
+            # 在途批次达到上限时先等一批完成，未分类的推文不会在内存里堆积
+            if len(in_flight) >= classify_concurrency:
+                drain(FIRST_COMPLETED)
+
+        batch = []
+        for tweet in tweets:
+            batch.append(tweet)
+            if len(batch) >= classify_batch_size:
+                submit(batch)
+                batch = []
+
+        if batch:
+            submit(batch)
+        if in_flight:
+            drain(ALL_COMPLETED)
+    finally:
+        # 中断或出错退出时：取消还没开始的批次，保存已经完成的结果，缓冲区全部写入后再退出
+        for future in list(in_flight):
+            future.cancel()
+        executor.shutdown(wait=True)
+        for future in [future for future in in_flight if future.done() and not future.cancelled()]:
+            store_results(in_flight.pop(future), future)
+        writer.flush()
+        llm_stats.flush()
 
     # Summary of the process
     print("\n" + "="*80)
-    print("Classification Summary:")
+    print(f"{title}:")
     print(f"🎯 Total unhandled issues: {unhandled_count}")
     print(f"⚠️ Total mishandled issues: {mishandled_count}")
     print(f"📢 Total non-issues: {non_issue_count}")
     print(f"❌ Total errors: {error_count}")
-    print(f"🔄 Skipped duplicates: {duplicate_count}")
+    print(f"📥 Queued for retry: {retries.queued}, ☠️ parked as poison: {retries.parked}")
+    print(f"🔄 Already stored (duplicate key ignored): {writer.duplicates}")
+    print(f"🗂️ Label cache hits: {cache_hits}/{cache_lookups} ({cache_hits / max(cache_lookups, 1):.1%})")
+    print(f"🤖 Labelled locally by the pre-filter (LLM classifications avoided): {prefiltered_count}")
+    if prefilter is not None and prefilter.holdout_agreement is not None:
+        print(f"🤖 Pre-filter holdout agreement: {prefilter.holdout_agreement:.1%} "
+              f"at threshold {prefilter.threshold} (coverage {prefilter.holdout_coverage:.1%})")
+    for line in llm_stats.report(unhandled_count + mishandled_count + non_issue_count):
+        print(f"📈 {line}")
     print("="*80)
 
+def retry_failed_classifications():
+    """快速重试：只处理重试队列里已到期的推文，和主流程共用同一套分类、写入逻辑。"""
+    if not classification_lock.acquire(blocking=False):
+        print("⏭️ Classification is already running, skipping the retry pass")
+        return
+
+    client = None
+    try:
+        client = connect_mongodb()
+        source_collection = client["tiktok"]["twitter"]
+        collections = {
+            1: client["tiktok"]["unhandled_issues"],
+            2: client["tiktok"]["mishandled_issues"],
+            3: client["tiktok"]["non_issues"],
+        }
+        retries = RetryQueue(client["tiktok"][RETRY_COLLECTION], source_collection)
+
+        due = [doc["_id"] for doc in retries.due(retry_pass_limit)]
+        if not due:
+            print("No failed classifications due for retry")
+            return
+
+        tweets = list(source_collection.find({"_id": {"$in": due}, "label": None}, {"retry": 0}))
+        # 已经有标签（例如旧版本重跑时分过类）或源文档已删除的条目直接移出队列
+        retries.resolve(set(due) - {tweet["_id"] for tweet in tweets})
+        print(f"Retrying {len(tweets)} failed classifications")
+        # 重试的多是模型答错格式或限流的推文，不用每次重新训练预筛模型
+        run_classification(client["tiktok"], source_collection, collections, retries, tweets, None, "Retry Pass Summary")
+    finally:
+        if client is not None:
+            client.close()
+        classification_lock.release()
+
 if __name__ == "__main__":
-    classify_and_store()
+    if "--retry" in sys.argv:
+        retry_failed_classifications()
+    else:
+        classify_and_store()
@@ -0,0 +1,67 @@
+import random
+
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import SGDClassifier
+
+prefilter_threshold = 0.9  # 本地模型最高类别概率不低于这个值才直接采用，否则交给 LLM
+holdout_fraction = 0.2  # 留出多少已标注数据评估与 LLM 标签的一致率
+min_training_examples = 300  # 已标注数据少于这个数时不启用预筛
+max_examples_per_label = 50000
+
+
+class PreFilter:
+    """Hashing-vectorizer + linear model trained on the LLM labels already stored.
+
+    Tweets the model is confident about are labelled locally; the rest still go to the LLM.
+    Until it has been trained on enough labels, `predict` defers every tweet.
+    """
+
+    def __init__(self, threshold=None, preprocessor=None):
+        self.threshold = prefilter_threshold if threshold is None else threshold
+        # 无状态的哈希特征，不需要词表，训练和预测都只占固定内存
+        self.vectorizer = HashingVectorizer(
+            n_features=2 ** 18, ngram_range=(1, 2), alternate_sign=False, preprocessor=preprocessor
+        )
+        self.model = None
+        self.holdout_agreement = None  # 留出集中被本地模型接手的部分，与 LLM 标签一致的比例
+        self.holdout_coverage = None  # 留出集中置信度达到阈值、会被本地模型接手的比例
+
+    def _fit(self, texts, labels):
+        model = SGDClassifier(loss="log_loss", alpha=1e-5, max_iter=20, tol=None, random_state=0)
+        model.fit(self.vectorizer.transform(texts), labels)
+        return model
+
+    def _confident(self, model, texts):
+        """返回 [(标签, 是否达到阈值)]。"""
+        probabilities = model.predict_proba(self.vectorizer.transform(texts))
+        return [
+            (int(model.classes_[row.argmax()]), row.max() >= self.threshold)
+            for row in probabilities
+        ]
+
+    def fit(self, texts, labels):
+        """先在留出集上评估，再用全部数据训练。数据不够或缺少某个类别时不启用，返回是否启用。"""
+        if len(texts) < min_training_examples or len(set(labels)) < 3:
+            return False
+
+        examples = list(zip(texts, labels))
+        random.Random(0).shuffle(examples)
+        split = int(len(examples) * (1 - holdout_fraction))
+        train, holdout = examples[:split], examples[split:]
+
+        model = self._fit([text for text, _ in train], [label for _, label in train])
+        predictions = self._confident(model, [text for text, _ in holdout])
+        confident = [(predicted, label) for (predicted, ok), (_, label) in zip(predictions, holdout) if ok]
+        self.holdout_coverage = len(confident) / len(holdout)
+        self.holdout_agreement = (
+            sum(1 for predicted, label in confident if predicted == label) / len(confident) if confident else None
+        )
+
+        self.model = self._fit(texts, labels)
+        return True
+
+    def predict(self, texts):
+        """返回标签列表，置信度不够的位置是 None（交给 LLM）。"""
+        if self.model is None or not texts:
+            return [None] * len(texts)
+        return [label if ok else None for label, ok in self._confident(self.model, texts)]
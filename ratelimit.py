@@ -0,0 +1,127 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveTokenBucket:
+    """Thread-safe token bucket whose refill rate follows the RapidAPI x-ratelimit-* headers.
+
+    The rate climbs additively towards the highest rate the remaining quota allows,
+    is halved whenever the API throttles us, and pauses entirely when the quota is spent.
+    Only short windows (reset within `max_window` seconds) steer the rate; a long plan quota
+    (daily / monthly) that runs out marks the bucket `quota_exhausted` instead of pausing.
+    """
+
+    def __init__(self, rate, max_rate, min_rate=0.05, burst=1, increase_step=0.5, safety=0.9, max_window=3600):
+        self.rate = rate
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.burst = burst
+        self.increase_step = increase_step
+        self.safety = safety  # 只用掉配额允许速率的一部分，给其他调用方留余量
+        self.max_window = max_window
+
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._exhausted_until = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def quota_exhausted(self):
+        """长周期配额已用完：在它重置之前不应再发请求。"""
+        return time.monotonic() < self._exhausted_until
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        """阻塞直到拿到一个令牌。先预扣令牌（可为负数）再在锁外等待，等待顺序即先来先得。"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= 1
+            delay = max(self._paused_until - now, 0.0)
+            if self._tokens < 0:
+                delay = max(delay, -self._tokens / self.rate)
+        if delay > 0:
+            time.sleep(delay)
+
+    def on_throttled(self):
+        """收到 429：乘性降速。"""
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+        logger.warning(f"Throttled by API, rate lowered to {self.rate:.2f} req/s")
+
+    def update_from_headers(self, headers):
+        """根据 x-ratelimit-<name>-remaining / -reset 调整速率，取所有配额里最紧的那个。"""
+        quota_rate = None
+        pause = 0.0
+        exhausted = 0.0
+
+        headers = {name.lower(): value for name, value in headers.items()}
+        for name, value in headers.items():
+            if not (name.startswith("x-ratelimit-") and name.endswith("-remaining")):
+                continue
+            reset = headers.get(name[:-len("remaining")] + "reset")
+            try:
+                remaining = float(value)
+                reset = float(reset)
+            except (TypeError, ValueError):
+                continue
+
+            if reset > self.max_window:
+                # 按天 / 按月的套餐配额：用 remaining / reset 算出的速率低得没有意义，只关心是否用完
+                if remaining <= 0:
+                    exhausted = max(exhausted, reset)
+                continue
+            if remaining <= 0:
+                pause = max(pause, reset)
+                continue
+            allowed = self.safety * remaining / max(reset, 1.0)
+            quota_rate = allowed if quota_rate is None else min(quota_rate, allowed)
+
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if exhausted:
+                self._exhausted_until = max(self._exhausted_until, now + exhausted)
+            if pause:
+                self._paused_until = max(self._paused_until, now + pause)
+            elif quota_rate is not None:
+                # 有余量时加性提速；超过配额允许的速率时立刻降到配额上限（哪怕低于 min_rate）
+                self.rate = max(1e-3, min(self.rate + self.increase_step, self.max_rate, quota_rate))
+
+        if exhausted:
+            logger.error(f"API plan quota exhausted, it resets in {exhausted / 3600:.1f}h")
+        if pause:
+            logger.warning(f"API quota exhausted, pausing requests for {pause:.0f}s")
+
+
+class MinuteBudget:
+    """Thread-safe per-minute budget, e.g. the OpenAI requests-per-minute or tokens-per-minute limit.
+
+    The budget refills continuously at `per_minute / 60` units per second. `acquire(amount)`
+    reserves units up front and waits outside the lock, so callers are served in arrival order.
+    """
+
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self._available = per_minute
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount=1):
+        # 超过整分钟预算的单次请求按整分钟计，否则永远等不到
+        amount = min(amount, self.per_minute)
+        with self._lock:
+            now = time.monotonic()
+            self._available = min(self.per_minute, self._available + (now - self._updated) * self.per_minute / 60)
+            self._updated = now
+            self._available -= amount
+            delay = -self._available * 60 / self.per_minute if self._available < 0 else 0.0
+        if delay > 0:
+            time.sleep(delay)
@@ -1,11 +1,15 @@
 from apscheduler.schedulers.blocking import BlockingScheduler
-from datetime import datetime, timedelta
 import logging
 from pymongo import MongoClient
 import os
+import sys
 from dotenv import load_dotenv
 import fetchdata
+import engagement
+import loader
 import picking
+from config import DB_NAME
+from indexes import ensure_indexes, log_index_report
 
 # Load environment variables
 load_dotenv()
@@ -20,33 +24,89 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+def run_stage(name, task, *args, **kwargs):
+    # A failing stage is logged and the remaining stages still run
+    try:
+        task(*args, **kwargs)
+    except Exception as e:
+        logger.error(f"Error in {name}: {str(e)}")
+
+def report_indexes():
+    client = MongoClient(os.getenv("MONGO_URI"))
+    try:
+        log_index_report(client[DB_NAME])
+    finally:
+        client.close()
+
 def hourly_task():
+    # Each keyword queries from its own watermark (see fetchdata.keyword_start_date)
+    logger.info(f"Starting data fetch (watermark overlap {fetchdata.watermark_overlap_days} days)")
+    run_stage("data fetch", fetchdata.fetch_data, concurrent=True, resume=True)
+    logger.info("Data fetch completed")
+
+    if fetchdata.staged_writes:
+        logger.info("Loading staged pages into MongoDB")
+        run_stage("staged page load", loader.load_staged_pages)
+
+    logger.info(f"Refreshing engagement for tweets from the last {engagement.refresh_days} days")
+    run_stage("engagement refresh", engagement.refresh_engagement)
+    
+    logger.info("Starting data classification")
+    run_stage("data classification", picking.classify_and_store)
+    logger.info("Data classification completed")
+
+    run_stage("index report", report_indexes)
+
+def fetch_task():
     try:
-        current_time = datetime.now()
-        one_hour_ago = current_time - timedelta(hours=23)
-        # Use more precise time format
-        # fetchdata.start_date = one_hour_ago.strftime("%Y-%m-%d %H:%M:%S")
-        
-        logger.info(f"Starting data fetch from {fetchdata.start_date}")
-        fetchdata.fetch_data()
+        logger.info("Starting sharded data fetch")
+        fetchdata.fetch_data(concurrent=True, sharded=True)
         logger.info("Data fetch completed")
-        
-        logger.info("Starting data classification")
-        picking.classify_and_store()
-        logger.info("Data classification completed")
-        
+
+        # The staging log lives on this worker's disk, so this worker loads its own pages
+        if fetchdata.staged_writes:
+            logger.info("Loading staged pages into MongoDB")
+            loader.load_staged_pages()
+
     except Exception as e:
-        logger.error(f"Error in hourly task: {str(e)}")
+        logger.error(f"Error in fetch task: {str(e)}")
+
+def bootstrap_indexes():
+    client = MongoClient(os.getenv("MONGO_URI"))
+    try:
+        ensure_indexes(client[DB_NAME])
+        logger.info("Indexes ensured")
+    finally:
+        client.close()
 
 def main():
+    # Extra crawl workers only fetch: they split the keywords with the main worker through leases,
+    # on the same cycle, and leave migration, indexes and classification to the main worker
+    if "--fetch-only" in sys.argv:
+        run_scheduler(fetch_task)
+        return
+
+    # Legacy documents store creation_date as a string and never match the dashboard's date range;
+    # already-migrated documents are skipped, so this is cheap after the first run
+    logger.info("Migrating stored tweets to the compact schema")
+    fetchdata.migrate_to_compact_schema()
+    bootstrap_indexes()
+
+    # Retry failed classifications from the dead-letter queue between full runs
+    run_scheduler(hourly_task, (picking.retry_failed_classifications, picking.retry_pass_minutes))
+
+def run_scheduler(task, *extra_jobs):
     scheduler = BlockingScheduler()
     
     # Run task every hour
-    scheduler.add_job(hourly_task, 'interval', hours=23)
+    scheduler.add_job(task, 'interval', hours=23)
+
+    for job, minutes in extra_jobs:
+        scheduler.add_job(job, 'interval', minutes=minutes)
     
     # Run immediately on startup
     logger.info("Running initial task...")
-    hourly_task()
+    task()
     
     logger.info("Scheduler started")
     try:
@@ -0,0 +1,119 @@
+import logging
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# 限流和服务端临时故障可以重试；其余 4xx（鉴权失败、参数错误）重试也没用
+RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+
+class SearchError(Exception):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class RetryableSearchError(SearchError):
+    """Transient failure (throttling, 5xx, network) that survived every retry."""
+
+
+class FatalSearchError(SearchError):
+    """Failure that retrying cannot fix, e.g. a bad API key or invalid params."""
+
+
+class QuotaExhaustedError(FatalSearchError):
+    """The daily / monthly plan quota is spent; no request can succeed until it resets."""
+
+
+def parse_retry_after(value):
+    """Retry-After 可以是秒数，也可以是 HTTP 日期；无法解析时返回 None。"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class SearchClient:
+    """Keep-alive HTTP client for the RapidAPI search endpoint with bounded, jittered retries."""
+
+    def __init__(self, url, headers, pool_size=10, timeout=30, max_retries=5, backoff_base=1.0, backoff_max=60.0,
+                 rate_limiter=None):
+        self.url = url
+        self.rate_limiter = rate_limiter
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        # 连接池大小要不小于并发数，否则多出来的线程每次都要重新握手
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def backoff(self, attempt):
+        # full jitter：在 [0, base * 2^attempt] 内随机，避免多个关键词同时醒来再次撞上限流
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def get(self, params):
+        """返回响应对象；可重试错误按退避重试，不可重试或重试耗尽时抛出 SearchError。"""
+        attempt = 0
+        while True:
+            if self.rate_limiter and self.rate_limiter.quota_exhausted:
+                raise QuotaExhaustedError("API plan quota exhausted")
+            # 重试也要拿令牌，限流器看到的是真实的请求数
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
+            try:
+                response = self.session.get(self.url, params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.max_retries:
+                    raise RetryableSearchError(f"Network error after {attempt + 1} attempts: {e}")
+                delay = self.backoff(attempt)
+                logger.warning(f"Network error: {e}, retrying in {delay:.1f}s")
+            else:
+                if self.rate_limiter:
+                    self.rate_limiter.update_from_headers(response.headers)
+                    if response.status_code == 429:
+                        self.rate_limiter.on_throttled()
+
+                if response.status_code == 200:
+                    return response
+                if self.rate_limiter and self.rate_limiter.quota_exhausted:
+                    raise QuotaExhaustedError("API plan quota exhausted", response.status_code)
+
+                message = f"API error: {response.status_code} - {response.text[:200]}"
+                if response.status_code not in RETRYABLE_STATUS:
+                    raise FatalSearchError(message, response.status_code)
+                if attempt >= self.max_retries:
+                    raise RetryableSearchError(f"{message} (after {attempt + 1} attempts)", response.status_code)
+
+                # 服务端给了 Retry-After 就按它等，但不超过 backoff_max
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                delay = min(retry_after, self.backoff_max) if retry_after is not None else self.backoff(attempt)
+                logger.warning(f"{message}, retrying in {delay:.1f}s")
+
+            attempt += 1
+            time.sleep(delay)
+
+    def search(self, params):
+        return self.get(params).json()
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,90 @@
+import glob
+import io
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+import zstandard as zstd
+
+
+class SegmentLog:
+    """Append-only NDJSON log split into zstd-compressed segment files.
+
+    Each `append` call compresses its records into one zstd frame and appends it to the
+    active segment; concatenated frames are a valid zstd stream, so a segment can be
+    read back in one pass. A new segment starts when the active one reaches
+    `max_segment_bytes`, and every process starts its own segment, so writers never share a file.
+    The active segment carries an `.open` suffix until it is rotated, so readers in other
+    processes only ever see sealed segments.
+    """
+
+    def __init__(self, directory, prefix, max_segment_bytes=64 * 1024 * 1024, level=3):
+        self.directory = directory
+        self.prefix = prefix
+        self.max_segment_bytes = max_segment_bytes
+        self.level = level
+        self.active_segment = None
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def _new_segment(self):
+        self._sequence += 1
+        stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+        name = f"{self.prefix}-{stamp}-{os.getpid()}-{self._sequence:04d}.ndjson.zst.open"
+        return os.path.join(self.directory, name)
+
+    @staticmethod
+    def _seal(path):
+        if path and os.path.exists(path):
+            os.replace(path, path[:-len(".open")])
+
+    def append(self, records):
+        """把一批记录压缩成一个 frame 追加到当前分段，返回写入的分段路径。"""
+        if not records:
+            return None
+
+        payload = "".join(json.dumps(record, ensure_ascii=False, default=str) + "\n" for record in records)
+        frame = zstd.ZstdCompressor(level=self.level).compress(payload.encode("utf-8"))
+
+        with self._lock:
+            if self.active_segment is None or (
+                os.path.exists(self.active_segment)
+                and os.path.getsize(self.active_segment) + len(frame) > self.max_segment_bytes
+            ):
+                os.makedirs(self.directory, exist_ok=True)
+                self._seal(self.active_segment)
+                self.active_segment = self._new_segment()
+            with open(self.active_segment, "ab") as f:
+                f.write(frame)
+            return self.active_segment
+
+    def rotate(self):
+        """封存当前分段，之后的写入进入新分段。"""
+        with self._lock:
+            self._seal(self.active_segment)
+            self.active_segment = None
+
+    def segments(self):
+        """按时间顺序返回所有已封存的分段（包括其他进程写的）。"""
+        return sorted(glob.glob(os.path.join(self.directory, f"{self.prefix}-*.ndjson.zst")))
+
+    def seal_stale(self, max_age_seconds):
+        """封存写入进程已经退出（超过 max_age_seconds 未修改）的 .open 分段，返回封存的数量。"""
+        sealed = 0
+        now = time.time()
+        for path in glob.glob(os.path.join(self.directory, f"{self.prefix}-*.ndjson.zst.open")):
+            if path != self.active_segment and now - os.path.getmtime(path) > max_age_seconds:
+                self._seal(path)
+                sealed += 1
+        return sealed
+
+    @staticmethod
+    def read(path):
+        """逐行读取一个分段里的记录。"""
+        with open(path, "rb") as f:
+            reader = zstd.ZstdDecompressor().stream_reader(f, read_across_frames=True)
+            for line in io.TextIOWrapper(reader, encoding="utf-8"):
+                if line.strip():
+                    yield json.loads(line)